@@ -1,16 +1,178 @@
 #!/usr/bin/env python3
 """bcrypt and passwords"""
+import asyncio
 import bcrypt
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import functools
+import os
+import time
+import warnings
+from typing import Callable, Iterable, List, Tuple
 
+# Hash time aimed at by calibrate_rounds, in milliseconds: cost 12
+# takes about 300ms on our servers, so the default target leaves
+# room for calibration to raise it on faster ones
+TARGET_HASH_MS = 500
 
-def hash_password(password: str) -> bytes:
-    """Hash `password` and returns a salted, hashed password,
+# Bounds of the calibrated cost factor: calibration only ever raises
+# the cost above bcrypt's default of 12, and only BCRYPT_ROUNDS can
+# lower it
+MIN_ROUNDS = 12
+MAX_ROUNDS = 16
+
+
+def calibrate_rounds(target_ms: float = TARGET_HASH_MS,
+                     min_rounds: int = MIN_ROUNDS,
+                     max_rounds: int = MAX_ROUNDS) -> int:
+    """Return the highest bcrypt cost factor whose hash time
+    on this machine stays within `target_ms`
+
+    One hash is timed at `min_rounds`, then each extra round is counted
+    as doubling that time, as bcrypt's cost is exponential.
+    """
+    start = time.perf_counter()
+    bcrypt.hashpw(b'calibration', bcrypt.gensalt(min_rounds))
+    elapsed_ms = (time.perf_counter() - start) * 1000
+
+    # The floor is kept even when it misses the target, but not silently
+    if elapsed_ms > target_ms:
+        warnings.warn('bcrypt cost {} takes {:.0f}ms, over the {:.0f}ms '
+                      'target: using it anyway'.format(min_rounds, elapsed_ms,
+                                                       target_ms))
+
+    rounds = min_rounds
+    while rounds < max_rounds and elapsed_ms * 2 <= target_ms:
+        rounds += 1
+        elapsed_ms *= 2
+    return rounds
+
+
+@functools.lru_cache(maxsize=None)
+def get_rounds() -> int:
+    """Return the cost factor for new hashes, calibrated once per process
+    against BCRYPT_TARGET_MS, unless BCRYPT_ROUNDS sets it
+
+    Calibration hashes once at MIN_ROUNDS: call it at startup so that
+    the first hash of a request doesn't pay for it, as PasswordHasher does
+    """
+    try:
+        return int(os.environ['BCRYPT_ROUNDS'])
+    except (KeyError, ValueError):
+        pass
+    try:
+        target_ms = float(os.environ.get('BCRYPT_TARGET_MS', TARGET_HASH_MS))
+    except ValueError:
+        target_ms = TARGET_HASH_MS
+    return calibrate_rounds(target_ms)
+
+
+def hash_rounds(hashed_password: bytes) -> int:
+    """Return the cost factor a bcrypt hash was made with"""
+    return int(hashed_password.split(b'$')[2])
+
+
+def needs_rehash(hashed_password: bytes, rounds: int = None) -> bool:
+    """Check if `hashed_password` was made with a lower cost factor
+    than `rounds` (get_rounds() by default)
+    """
+    return hash_rounds(hashed_password) < (rounds or get_rounds())
+
+
+def hash_password(password: str, rounds: int = None) -> bytes:
+    """Hash `password` and returns a salted, hashed password,
     which is a byte string
     """
     return bcrypt.hashpw(password.encode('utf-8'),
-                         bcrypt.gensalt())
+                         bcrypt.gensalt(rounds or get_rounds()))
+
+
+def is_valid(hashed_password: bytes, password: str,
+             rehash: Callable[[bytes], None] = None) -> bool:
+    """Validate that the provided password matches the hashed password
+
+    If it does and the hash has an outdated cost factor, the password is
+    hashed again at the current cost and passed to `rehash` for storage.
+    """
+    if not bcrypt.checkpw(password.encode('utf-8'), hashed_password):
+        return False
+    if rehash is not None and needs_rehash(hashed_password):
+        rehash(hash_password(password))
+    return True
+
+
+def _is_valid_pair(pair: Tuple[bytes, str]) -> bool:
+    """Call is_valid on a (hashed_password, password) pair"""
+    return is_valid(*pair)
+
+
+class PasswordHasher:
+    """Hash and validate passwords on a pool of workers
+
+    bcrypt releases the GIL while hashing, so the default thread pool
+    already uses every core; `processes` switches to a process pool.
+    """
+
+    def __init__(self, rounds: int = None, max_workers: int = None,
+                 processes: bool = False):
+        self.rounds = rounds or get_rounds()
+        if processes:
+            self.executor = ProcessPoolExecutor(max_workers)
+        else:
+            self.executor = ThreadPoolExecutor(max_workers)
+
+    def hash(self, password: str) -> bytes:
+        """Hash one password on the pool"""
+        return self.executor.submit(hash_password, password,
+                                    self.rounds).result()
+
+    def verify(self, hashed_password: bytes, password: str) -> bool:
+        """Validate one password on the pool"""
+        return self.executor.submit(is_valid, hashed_password,
+                                    password).result()
+
+    def hash_many(self, passwords: Iterable[str]) -> List[bytes]:
+        """Hash `passwords` in parallel, keeping their order"""
+        passwords = list(passwords)
+        return list(self.executor.map(hash_password, passwords,
+                                      [self.rounds] * len(passwords)))
+
+    def verify_many(self,
+                    pairs: Iterable[Tuple[bytes, str]]) -> List[bool]:
+        """Validate (hashed_password, password) `pairs` in parallel,
+        keeping their order
+        """
+        return list(self.executor.map(_is_valid_pair, pairs))
+
+    async def hash_async(self, password: str) -> bytes:
+        """Hash one password without blocking the event loop"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, hash_password,
+                                          password, self.rounds)
+
+    async def verify_async(self, hashed_password: bytes,
+                           password: str) -> bool:
+        """Validate one password without blocking the event loop"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, is_valid,
+                                          hashed_password, password)
+
+    async def hash_many_async(self, passwords: Iterable[str]) -> List[bytes]:
+        """Hash `passwords` in parallel without blocking the event loop"""
+        return list(await asyncio.gather(
+            *(self.hash_async(password) for password in passwords)))
+
+    async def verify_many_async(
+            self, pairs: Iterable[Tuple[bytes, str]]) -> List[bool]:
+        """Validate `pairs` in parallel without blocking the event loop"""
+        return list(await asyncio.gather(
+            *(self.verify_async(*pair) for pair in pairs)))
+
+    def close(self) -> None:
+        """Shut the pool down"""
+        self.executor.shutdown()
 
+    def __enter__(self) -> 'PasswordHasher':
+        return self
 
-def is_valid(hashed_password: bytes, password: str) -> bool:
-    """Validate that the provided password matches the hashed password"""
-    return bcrypt.checkpw(password.encode('utf-8'), hashed_password)
+    def __exit__(self, *exc_info) -> None:
+        self.close()
@@ -2,14 +2,32 @@
 """Implement log filters obfuscating some fields
 """
 import csv
+import functools
 import logging
+import logging.handlers
 import mysql.connector
 import os
+import queue
 import re
-from typing import List
+import sys
+import threading
+from typing import Any, Callable, Iterable, Iterator, List, TextIO, Tuple
 
 PII_FIELDS = ('name', 'email', 'phone', 'ssn', 'password')
 
+# Number of rows fetched, redacted and written at once by export_users
+EXPORT_BATCH_SIZE = 1000
+
+# Default number of records waiting in the queue of an asynchronous logger
+LOG_QUEUE_SIZE = 10000
+
+# Default number of idle connections kept by the connection pool
+DB_POOL_SIZE = 5
+
+# Shared connection pool, created on the first call to get_pool
+_db_pool = None
+_db_pool_lock = threading.Lock()
+
 
 class RedactingFormatter(logging.Formatter):
     """ Redacting Formatter class
@@ -22,15 +40,62 @@ class RedactingFormatter(logging.Formatter):
     def __init__(self, fields: List[str]):
         super(RedactingFormatter, self).__init__(self.FORMAT)
         self.fields = fields
+        self.redactor = Redactor(fields, self.REDACTION, self.SEPARATOR)
 
     def format(self, record: logging.LogRecord) -> str:
-        """Filter values in this log record using filter_datum,
+        """Filter values in this log record using the redactor,
         format it and return it
         """
-        record.msg = filter_datum(self.fields, self.REDACTION,
-                                  record.getMessage(), self.SEPARATOR)
+        record.msg = self.redactor.redact(record.getMessage())
         return super().format(record)
 
+    def format_batch(self, record: logging.LogRecord,
+                     messages: Iterable[str]) -> str:
+        """Format `messages` as log lines sharing the header of `record`,
+        and redact the whole batch with a single pass of the redactor
+        """
+        record.msg = ''
+        record.args = None
+        header = super().format(record)
+        batch = ''.join(f'{header}{message}\n' for message in messages)
+        return self.redactor.redact(batch)
+
+
+class Redactor:
+    """Obfuscate all fields of a log line in a single pass
+
+    The field names and the separator are compiled once into a single
+    regex alternating over all fields, so each line is scanned only once.
+    """
+
+    def __init__(self, fields: Iterable[str], redaction: str,
+                 separator: str):
+        fields = tuple(fields)
+
+        # No pattern at all when there is nothing to redact
+        self.pattern = None
+        if fields:
+            self.pattern = re.compile(r'({})=.*?{}'.format(
+                '|'.join(re.escape(f) for f in fields),
+                re.escape(separator)))
+
+        # Escape backslashes so `redaction` and `separator` stay literal
+        self.replacement = r'\g<1>=' + \
+            (redaction + separator).replace('\\', r'\\')
+
+    def redact(self, message: str) -> str:
+        """Return `message` with the values of all fields obfuscated"""
+        if self.pattern is None:
+            return message
+        return self.pattern.sub(self.replacement, message)
+
+
+@functools.lru_cache(maxsize=32)
+def get_redactor(fields: Tuple[str, ...], redaction: str,
+                 separator: str) -> Redactor:
+    """Return the Redactor for these arguments, compiled only once"""
+    return Redactor(fields, redaction, separator)
+
 
 def filter_datum(fields: List[str], redaction: str,
                  message: str, separator: str) -> str:
@@ -43,15 +108,60 @@ def filter_datum(fields: List[str], redaction: str,
         separator: a string representing by which character is separating
         all fields in the log line (message)
     """
-    obf_msg = message
-    for f in fields:
-        obf_msg = re.sub(r'{}=.*?{}'.format(f, separator),
-                         f'{f}={redaction}{separator}', obf_msg)
-    return obf_msg
+    redactor = get_redactor(tuple(fields), redaction, separator)
+    return redactor.redact(message)
+
+
+class BoundedQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler on a bounded queue, whose records are redacted,
+    formatted and written by a QueueListener on a background thread
+
+    When the queue is full, records are either dropped (and counted in
+    `dropped`) or the caller blocks until there is room, if `block` is set.
+    """
+
+    def __init__(self, handler: logging.Handler,
+                 maxsize: int = LOG_QUEUE_SIZE, block: bool = False):
+        super().__init__(queue.Queue(maxsize))
+        self.block = block
+        self.dropped = 0
+        self.listener = _QueueListener(self.queue, handler)
+        self.listener.start()
 
+    def enqueue(self, record: logging.LogRecord) -> None:
+        """Put `record` in the queue following the drop or block policy"""
+        if self.block:
+            self.queue.put(record)
+            return
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
 
-def get_logger() -> logging.Logger:
-    """Return a logging.Logger object"""
+    def close(self) -> None:
+        """Stop the listener once all queued records have been handled"""
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+        super().close()
+
+
+class _QueueListener(logging.handlers.QueueListener):
+    """QueueListener waiting for room in a full queue to stop"""
+
+    def enqueue_sentinel(self) -> None:
+        self.queue.put(self._sentinel)
+
+
+def get_logger(asynchronous: bool = False,
+               queue_size: int = LOG_QUEUE_SIZE,
+               block: bool = False) -> logging.Logger:
+    """Return a logging.Logger object
+
+    With `asynchronous`, records go through a BoundedQueueHandler of
+    `queue_size` records so redaction and writes happen off the caller's
+    thread. Calling it again replaces the handlers instead of stacking them.
+    """
 
     # Create logger
     logger = logging.getLogger('user_data')
@@ -60,38 +170,225 @@ def get_logger() -> logging.Logger:
     logger.setLevel(logging.INFO)
     logger.propagate = False
 
+    # Remove handlers of previous calls
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+        handler.close()
+
     # Create stream handler
     stream_handler = logging.StreamHandler()
 
     # Set formatter as RedactingFormatter
     stream_handler.setFormatter(RedactingFormatter(list(PII_FIELDS)))
 
+    # Put a queue in front of it if asked
+    if asynchronous:
+        handler = BoundedQueueHandler(stream_handler, queue_size, block)
+    else:
+        handler = stream_handler
+
     # Add the handler to logger
-    logger.addHandler(stream_handler)
+    logger.addHandler(handler)
 
     # Return logger
     return logger
 
 
+class ConnectionPool:
+    """Keep up to `size` idle database connections open and hand them out
+    again instead of connecting on every call
+
+    `connect` is any callable returning a new DB-API connection, so the
+    pool works the same with mysql.connector, sqlite3 or a fake connector.
+    """
+
+    def __init__(self, connect: Callable[[], Any],
+                 size: int = DB_POOL_SIZE):
+        self.connect = connect
+        self.size = size
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    @staticmethod
+    def is_healthy(connection) -> bool:
+        """Check that `connection` still answers a trivial query"""
+        try:
+            cursor = connection.cursor()
+            try:
+                cursor.execute('SELECT 1')
+                cursor.fetchall()
+            finally:
+                cursor.close()
+        except Exception:
+            return False
+        return True
+
+    @staticmethod
+    def discard(connection) -> None:
+        """Close `connection` ignoring any error"""
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def acquire(self) -> 'PooledConnection':
+        """Return a healthy idle connection, or a new one if none is left
+        """
+        while True:
+            try:
+                connection = self._idle.get_nowait()
+            except queue.Empty:
+                return PooledConnection(self, self.connect())
+
+            # Drop connections that died while idle
+            if self.is_healthy(connection):
+                return PooledConnection(self, connection)
+            self.discard(connection)
+
+    def release(self, connection) -> None:
+        """Give `connection` back to the pool, or close it
+        if the pool is already full
+
+        Its transaction is rolled back first, so the next caller
+        neither sees its uncommitted writes nor its stale snapshot;
+        a connection that can't roll back is closed instead.
+        """
+        try:
+            connection.rollback()
+        except Exception:
+            self.discard(connection)
+            return
+        try:
+            self._idle.put_nowait(connection)
+        except queue.Full:
+            self.discard(connection)
+
+    def close(self) -> None:
+        """Close all idle connections"""
+        while True:
+            try:
+                self.discard(self._idle.get_nowait())
+            except queue.Empty:
+                return
+
+
+class PooledConnection:
+    """Proxy to a pooled connection whose close() gives it back
+    to its pool instead of closing it
+    """
+
+    def __init__(self, pool: ConnectionPool, connection):
+        self._pool = pool
+        self._connection = connection
+
+    def __getattr__(self, name: str):
+        if self._connection is None:
+            raise AttributeError(f'{name}: connection already released')
+        return getattr(self._connection, name)
+
+    def close(self) -> None:
+        """Release the connection to the pool"""
+        if self._connection is not None:
+            self._pool.release(self._connection)
+            self._connection = None
+
+    def __enter__(self) -> 'PooledConnection':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def connect_db() -> mysql.connector.connection.MySQLConnection:
+    """ Open a new MySQLConnection based on credentials in os.environ
+    """
+    return mysql.connector.connect(
+            host=os.environ.get('PERSONAL_DATA_DB_HOST', 'localhost'),
+            database=os.environ.get('PERSONAL_DATA_DB_NAME'),
+            user=os.environ.get('PERSONAL_DATA_DB_USERNAME', 'root'),
+            password=os.environ.get('PERSONAL_DATA_DB_PASSWORD', '')
+            )
+
+
+def get_pool() -> ConnectionPool:
+    """Return the process-wide pool of connections opened by connect_db,
+    sized by PERSONAL_DATA_DB_POOL_SIZE
+    """
+    global _db_pool
+
+    with _db_pool_lock:
+        if _db_pool is None:
+            try:
+                size = int(os.environ.get('PERSONAL_DATA_DB_POOL_SIZE',
+                                          DB_POOL_SIZE))
+            except ValueError:
+                size = DB_POOL_SIZE
+            _db_pool = ConnectionPool(connect_db, max(size, 1))
+        return _db_pool
+
+
 def get_db() -> mysql.connector.connection.MySQLConnection:
     """ Return a MySQLConnection object based on credentials in os.environ
+
+    The connection comes from the pool returned by get_pool, and closing it
+    gives it back to the pool. Return None if no connection can be made.
     """
 
     # Connect with credentials
     try:
-        connection = mysql.connector.connect(
-                host=os.environ.get('PERSONAL_DATA_DB_HOST', 'localhost'),
-                database=os.environ.get('PERSONAL_DATA_DB_NAME'),
-                user=os.environ.get('PERSONAL_DATA_DB_USERNAME', 'root'),
-                password=os.environ.get('PERSONAL_DATA_DB_PASSWORD', '')
-                )
-    except BaseException:
+        connection = get_pool().acquire()
+    except mysql.connector.Error:
         return None
 
     # Return connection
     return connection
 
 
+def fetch_batches(cursor, batch_size: int) -> Iterator[List[str]]:
+    """Yield the rows of an executed `cursor` as batches of
+    `field=value;` messages, fetching `batch_size` rows at a time
+    """
+    columns = cursor.column_names
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        yield [''.join(f'{col}={value};' for col, value in zip(columns, row))
+               for row in rows]
+
+
+def export_users(db, stream: TextIO = None,
+                 batch_size: int = EXPORT_BATCH_SIZE) -> int:
+    """Stream all rows of the users table to `stream` (stderr by default)
+    under a filtered format, `batch_size` rows at a time,
+    and return the number of exported rows
+
+    Only one batch is held in memory, and each batch is redacted
+    and written at once instead of going through the logger row by row.
+    """
+    if stream is None:
+        stream = sys.stderr
+
+    formatter = RedactingFormatter(list(PII_FIELDS))
+
+    # Retrieve rows
+    cursor = db.cursor()
+    cursor.execute('SELECT * FROM users;')
+
+    # Write them batch by batch
+    count = 0
+    try:
+        for batch in fetch_batches(cursor, batch_size):
+            record = logging.LogRecord('user_data', logging.INFO,
+                                       __file__, 0, '', None, None)
+            stream.write(formatter.format_batch(record, batch))
+            stream.flush()
+            count += len(batch)
+    finally:
+        cursor.close()
+
+    return count
+
+
 def main() -> None:
     """Obtain a database connection using get_db,
     retrieve all rows in the users table,
@@ -101,22 +398,15 @@ def main() -> None:
     # Obtain connection
     db = get_db()
 
-    # Retrieve rows
-    cursor = db.cursor()
-    cursor.execute('SELECT * FROM users;')
-
-    # Get logger
-    logger = get_logger()
-
-    # Log data
-    for row in cursor:
-        data = ''
-        for i in range(len(row)):
-            data += f'{cursor.column_names[i]}={row[i]};'
-        logger.info(data)
+    # Export rows
+    try:
+        batch_size = int(os.environ.get('PERSONAL_DATA_EXPORT_BATCH_SIZE',
+                                        EXPORT_BATCH_SIZE))
+    except ValueError:
+        batch_size = EXPORT_BATCH_SIZE
+    export_users(db, batch_size=batch_size)
 
     # Close resources
-    cursor.close()
     db.close()
 
 
@@ -3,6 +3,7 @@
 """
 from datetime import datetime
 from typing import TypeVar, List, Iterable
+from models.index import HashIndex
 from os import path
 import json
 import uuid
@@ -10,18 +11,24 @@ import uuid
 
 TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"
 DATA = {}
+INDEXES = {}
 
 
 class Base():
     """ Base class
     """
 
+    # Attributes with a hash index, kept up to date by save() and remove()
+    # and used by search()
+    INDEXED_ATTRIBUTES = ()
+
     def __init__(self, *args: list, **kwargs: dict):
         """ Initialize a Base instance
         """
         s_class = str(self.__class__.__name__)
         if DATA.get(s_class) is None:
             DATA[s_class] = {}
+            self.__class__.build_indexes()
 
         self.id = kwargs.get('id', str(uuid.uuid4()))
         if kwargs.get('created_at') is not None:
@@ -71,6 +78,28 @@ class Base():
             objs_json = json.load(f)
             for obj_id, obj_json in objs_json.items():
                 DATA[s_class][obj_id] = cls(**obj_json)
+        cls.build_indexes()
+
+    @classmethod
+    def build_indexes(cls) -> dict:
+        """ Build the indexes of INDEXED_ATTRIBUTES from all objects
+        """
+        s_class = cls.__name__
+        indexes = {attr: HashIndex(attr) for attr in cls.INDEXED_ATTRIBUTES}
+        for obj in DATA.get(s_class, {}).values():
+            for index in indexes.values():
+                index.add(obj)
+        INDEXES[s_class] = indexes
+        return indexes
+
+    @classmethod
+    def indexes(cls) -> dict:
+        """ Return the indexes of the class by attribute
+        """
+        indexes = INDEXES.get(cls.__name__)
+        if indexes is None:
+            indexes = cls.build_indexes()
+        return indexes
 
     @classmethod
     def save_to_file(cls):
@@ -91,6 +120,8 @@ class Base():
         s_class = self.__class__.__name__
         self.updated_at = datetime.utcnow()
         DATA[s_class][self.id] = self
+        for index in self.__class__.indexes().values():
+            index.add(self)
         self.__class__.save_to_file()
 
     def remove(self):
@@ -99,6 +130,8 @@ class Base():
         s_class = self.__class__.__name__
         if DATA[s_class].get(self.id) is not None:
             del DATA[s_class][self.id]
+            for index in self.__class__.indexes().values():
+                index.discard(self.id)
             self.__class__.save_to_file()
 
     @classmethod
@@ -124,8 +157,20 @@ class Base():
     @classmethod
     def search(cls, attributes: dict = {}) -> List[TypeVar('Base')]:
         """ Search all objects with matching attributes
+
+        Candidates come from the index of the first indexed attribute,
+        so they reflect values as of the last save() of each object
         """
         s_class = cls.__name__
+        objs = DATA[s_class].values()
+        indexes = cls.indexes()
+        for k, v in attributes.items():
+            if k in indexes:
+                try:
+                    objs = indexes[k].lookup(v)
+                    break
+                except TypeError:
+                    continue
 
         def _search(obj):
             if len(attributes) == 0:
@@ -135,4 +180,4 @@ class Base():
                     return False
             return True
 
-        return list(filter(_search, DATA[s_class].values()))
+        return list(filter(_search, objs))
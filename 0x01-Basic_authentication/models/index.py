@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+""" Index module
+"""
+from typing import Dict, List, TypeVar
+
+
+class HashIndex():
+    """ Secondary index mapping the values of one attribute
+    to the objects holding them
+    """
+
+    def __init__(self, attribute: str):
+        """ Initialize an empty index on `attribute`
+        """
+        self.attribute = attribute
+        self.__buckets: Dict = {}
+        self.__values: Dict = {}
+
+    def add(self, obj: TypeVar('Base')):
+        """ Index `obj` under its current value of the attribute
+        """
+        self.discard(obj.id)
+        value = getattr(obj, self.attribute, None)
+        try:
+            bucket = self.__buckets.setdefault(value, {})
+        except TypeError:
+            # Unhashable values are left to linear search
+            return
+        bucket[obj.id] = obj
+        self.__values[obj.id] = value
+
+    def discard(self, obj_id: str):
+        """ Remove the object with this ID from the index
+        """
+        if obj_id not in self.__values:
+            return
+        value = self.__values.pop(obj_id)
+        bucket = self.__buckets[value]
+        del bucket[obj_id]
+        if len(bucket) == 0:
+            del self.__buckets[value]
+
+    def lookup(self, value) -> List[TypeVar('Base')]:
+        """ Return all objects indexed under `value`
+        Raise TypeError if `value` isn't hashable
+        """
+        return list(self.__buckets.get(value, {}).values())
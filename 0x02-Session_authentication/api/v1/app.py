@@ -3,6 +3,7 @@
 Route module for the API
 """
 from os import getenv
+from api.v1.auth.auth import PathMatcher
 from api.v1.views import app_views
 from flask import abort, Flask, jsonify, request
 from flask_cors import (CORS, cross_origin)
@@ -12,8 +13,9 @@ app = Flask(__name__)
 app.register_blueprint(app_views)
 CORS(app, resources={r"/api/v1/*": {"origins": "*"}})
 
-# auth variable
+# auth variable, and reaper of expired sessions if any
 auth = None
+reaper = None
 
 auth_type = getenv('AUTH_TYPE')
 
@@ -35,14 +37,33 @@ elif auth_type == 'session_exp_auth':
     auth = SessionExpAuth()
 elif auth_type == 'session_db_auth':
 
-    # Load UserSession DB
+    # Load UserSession DB, keeping the session reaper CLI
+    # from rewriting its files while the API runs
     from models.user_session import UserSession
+    sessions_lock = UserSession.lock_files()
     UserSession.load_from_file()
 
     # Assign a SessionDBAuth instance
     from api.v1.auth.session_db_auth import SessionDBAuth
     auth = SessionDBAuth()
 
+    # Delete expired sessions in the background if asked
+    try:
+        reaper_interval = float(getenv('SESSION_REAPER_INTERVAL', 0))
+    except ValueError:
+        reaper_interval = 0
+    if reaper_interval > 0 and auth.session_duration > 0:
+        from api.v1.auth.session_reaper import SessionReaper
+        reaper = SessionReaper(auth.session_duration, reaper_interval)
+        reaper.start()
+
+
+# Paths not requiring authentication, compiled once
+excluded_paths = PathMatcher(['/api/v1/status/',
+                              '/api/v1/unauthorized/',
+                              '/api/v1/forbidden/',
+                              '/api/v1/auth_session/login/'])
+
 
 @app.before_request
 def before_request():
@@ -52,23 +73,18 @@ def before_request():
     if not auth:
         return
 
-    elif not auth.require_auth(request.path,
-                               ['/api/v1/status/',
-                                '/api/v1/unauthorized/',
-                                '/api/v1/forbidden/',
-                                '/api/v1/auth_session/login/']):
+    elif not auth.require_auth(request.path, excluded_paths):
         return
 
     elif not auth.authorization_header(request) and \
             not auth.session_cookie(request):
         abort(401)
 
-    elif not auth.current_user(request):
+    # Resolve the user once, it stays memoized for the rest of the request
+    request.current_user = auth.current_user(request)
+    if not request.current_user:
         abort(403)
 
-    else:
-        request.current_user = auth.current_user(request)
-
 
 @app.errorhandler(404)
 def not_found(error) -> str:
@@ -1,18 +1,100 @@
 #!/usr/bin/env python3
 """The Auth class"""
 from flask import request
-from typing import List, TypeVar
+import functools
+from typing import Callable, List, Tuple, TypeVar
 import os
 
+# Key of the request environ holding the users already resolved for it
+CURRENT_USER_KEY = 'api.v1.auth.current_user'
+
+
+def memoize_per_request(current_user: Callable) -> Callable:
+    """Make a `current_user` method resolve the user only once per request,
+    keeping it in the WSGI environ of that request
+    """
+
+    @functools.wraps(current_user)
+    def wrapper(self, request=None):
+        environ = getattr(request, 'environ', None)
+        if not isinstance(environ, dict):
+            return current_user(self, request)
+
+        memo = environ.setdefault(CURRENT_USER_KEY, {})
+        if id(self) not in memo:
+            memo[id(self)] = current_user(self, request)
+        return memo[id(self)]
+
+    return wrapper
+
+
+class PathMatcher:
+    """Excluded paths compiled into an exact-match set for paths ending
+    by '/' and a prefix trie for paths ending by '*', so matching a path
+    costs O(len(path)) whatever the number of excluded paths
+    """
+
+    # Key marking the end of a prefix in the trie
+    END = ''
+
+    def __init__(self, excluded_paths: List[str]):
+        self.exact = set()
+        self.trie = {}
+        for ex_path in excluded_paths:
+
+            # if ex_path ends with '/'
+            if ex_path.endswith('/'):
+                self.exact.add(ex_path)
+
+            # if ex_path endswith '*'
+            elif ex_path.endswith('*'):
+                node = self.trie
+                for char in ex_path[:-1]:
+                    node = node.setdefault(char, {})
+                node[self.END] = True
+
+    def __bool__(self) -> bool:
+        return bool(self.exact or self.trie)
+
+    def match(self, path: str) -> bool:
+        """Return True if `path` is one of the excluded paths"""
+        if path in self.exact:
+            return True
+
+        # Walk the trie until a prefix ends or the path leaves it
+        node = self.trie
+        if self.END in node:
+            return True
+        for char in path:
+            node = node.get(char)
+            if node is None:
+                return False
+            if self.END in node:
+                return True
+        return False
+
+
+@functools.lru_cache(maxsize=32)
+def compile_paths(excluded_paths: Tuple[str, ...]) -> PathMatcher:
+    """Return the PathMatcher of `excluded_paths`, compiled only once"""
+    return PathMatcher(excluded_paths)
+
 
 class Auth:
     """Class to manage the API authentication
     """
 
+    def __init_subclass__(cls, **kwargs):
+        """Memoize per request the current_user of every subclass"""
+        super().__init_subclass__(**kwargs)
+        if 'current_user' in cls.__dict__:
+            cls.current_user = memoize_per_request(cls.current_user)
+
     def require_auth(self, path: str, excluded_paths: List[str]) -> bool:
         """Return True `path` is not in `excluded_paths`
         with slash tolerance
         Note: All paths in `excluded_paths` end by a '/' or '*'
+        `excluded_paths` may also be a PathMatcher compiled beforehand
         """
 
         # If None or empty
@@ -23,20 +105,10 @@ class Auth:
         if not path.endswith('/'):
             path += '/'
 
-        for ex_path in excluded_paths:
-
-            # if ex_path ends with '/'
-            if ex_path.endswith('/'):
-                if path == ex_path:
-                    return False
-
-            # if ex_path endswith '*'
-            elif ex_path.endswith('*'):
-                if path[:len(ex_path) - 1] == ex_path[:-1]:
-                    return False
-
-        # Authorization not required
-        return True
+        # Authorization not required for excluded paths
+        if not isinstance(excluded_paths, PathMatcher):
+            excluded_paths = compile_paths(tuple(excluded_paths))
+        return not excluded_paths.match(path)
 
     def authorization_header(self, request=None) -> str:
         """Return the value of the header request 'Authorization' if it exists
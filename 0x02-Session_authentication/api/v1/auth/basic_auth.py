@@ -3,14 +3,96 @@
 from api.v1.auth.auth import Auth
 import base64
 import binascii
+from collections import OrderedDict
+import hashlib
+import hmac
 from models.user import User
+import os
+import threading
+import time
 from typing import TypeVar
 
 
+class CredentialCache:
+    """Bounded LRU cache, with a time to live, of the users already verified
+    for an Authorization header
+
+    Headers are only kept as HMAC digests under a per-process random key.
+    A hit is dropped if the user has since been removed or changed password.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.__key = os.urandom(32)
+        self.__entries = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def digest(self, authorization_header: str) -> bytes:
+        """Return the keyed digest of `authorization_header`"""
+        return hmac.new(self.__key, authorization_header.encode('utf-8'),
+                        hashlib.sha256).digest()
+
+    def get(self, authorization_header: str) -> TypeVar('User'):
+        """Return the user verified for `authorization_header`
+        if still valid, None otherwise
+        """
+        if self.maxsize <= 0:
+            return None
+        digest = self.digest(authorization_header)
+
+        # Find a live entry and mark it as recently used
+        with self.__lock:
+            entry = self.__entries.get(digest)
+            if entry is None:
+                return None
+            user_id, password, expires_at = entry
+            if time.monotonic() >= expires_at:
+                del self.__entries[digest]
+                return None
+            self.__entries.move_to_end(digest)
+
+        # Drop it if the user was removed or changed password since
+        user = User.get(user_id)
+        if user is None or user.password != password:
+            with self.__lock:
+                self.__entries.pop(digest, None)
+            return None
+        return user
+
+    def put(self, authorization_header: str, user: TypeVar('User')):
+        """Remember that `authorization_header` was verified for `user`"""
+        if self.maxsize <= 0:
+            return
+        digest = self.digest(authorization_header)
+        with self.__lock:
+            self.__entries[digest] = (user.id, user.password,
+                                      time.monotonic() + self.ttl)
+            self.__entries.move_to_end(digest)
+            while len(self.__entries) > self.maxsize:
+                self.__entries.popitem(last=False)
+
+    def clear(self):
+        """Forget all verified headers"""
+        with self.__lock:
+            self.__entries.clear()
+
+
 class BasicAuth(Auth):
     """Class to manage the API Basic Authentication
     """
 
+    def __init__(self):
+        """Set up the cache of verified credentials, sized by
+        BASIC_AUTH_CACHE_SIZE and expiring after BASIC_AUTH_CACHE_TTL seconds
+        """
+        try:
+            maxsize = int(os.getenv('BASIC_AUTH_CACHE_SIZE', 1024))
+            ttl = float(os.getenv('BASIC_AUTH_CACHE_TTL', 300))
+        except ValueError:
+            maxsize, ttl = 1024, 300
+        self.credential_cache = CredentialCache(maxsize, ttl)
+
     def extract_base64_authorization_header(self,
                                             authorization_header: str) -> str:
         """Return the Base64 part of the Authorization header
@@ -81,6 +163,11 @@ class BasicAuth(Auth):
         if not auth_value:
             return None
 
+        # Skip all the checks if this header was already verified
+        user = self.credential_cache.get(auth_value)
+        if user is not None:
+            return user
+
         # Get the Base 64 part if provided
         base64_part = self.extract_base64_authorization_header(auth_value)
         if not base64_part:
@@ -98,4 +185,7 @@ class BasicAuth(Auth):
 
         # Find and Return the user if `credentials` are correct,
         # Return None otherwise
-        return self.user_object_from_credentials(*credentials)
+        user = self.user_object_from_credentials(*credentials)
+        if user is not None:
+            self.credential_cache.put(auth_value, user)
+        return user
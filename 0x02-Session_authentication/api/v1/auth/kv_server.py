@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""A local key-value server speaking the Redis protocol (RESP)
+
+Stands in for Redis behind KeyValueBackend, with the commands it uses:
+PING, GET, MGET, SET (with EX/PX), DEL, EXISTS, DBSIZE and FLUSHDB.
+Pipelined commands are answered with a single write.
+
+Run it with:
+$ KV_HOST=127.0.0.1 KV_PORT=6380 python3 -m api.v1.auth.kv_server
+"""
+from os import getenv
+import socketserver
+import threading
+import time
+from typing import List, Optional, Tuple
+
+
+def parse_command(buf: bytes, pos: int) -> Tuple[Optional[List[bytes]], int]:
+    """Parse one RESP array of bulk strings (or an inline command)
+    starting at `pos` in `buf`
+
+    Return the command arguments and the position after them,
+    or (None, pos) if the command isn't complete yet
+    """
+    end = buf.find(b'\r\n', pos)
+    if end < 0:
+        return None, pos
+
+    # Inline command, e.g. sent by telnet
+    if buf[pos:pos + 1] != b'*':
+        return buf[pos:end].split(), end + 2
+
+    args = []
+    count = int(buf[pos + 1:end])
+    cursor = end + 2
+    for _ in range(count):
+        end = buf.find(b'\r\n', cursor)
+        if end < 0:
+            return None, pos
+        length = int(buf[cursor + 1:end])
+        start = end + 2
+        if len(buf) < start + length + 2:
+            return None, pos
+        args.append(buf[start:start + length])
+        cursor = start + length + 2
+    return args, cursor
+
+
+def encode_reply(reply) -> bytes:
+    """Encode a Python value as a RESP reply"""
+    if reply is None:
+        return b'$-1\r\n'
+    if isinstance(reply, int):
+        return b':%d\r\n' % reply
+    if isinstance(reply, str):
+        return ('+' + reply + '\r\n').encode('utf-8')
+    if isinstance(reply, Exception):
+        return ('-ERR ' + str(reply) + '\r\n').encode('utf-8')
+    if isinstance(reply, list):
+        return b'*%d\r\n' % len(reply) + \
+            b''.join(encode_reply(item) for item in reply)
+    return b'$%d\r\n%s\r\n' % (len(reply), reply)
+
+
+class KeyValueHandler(socketserver.BaseRequestHandler):
+    """Answer the commands of one client connection"""
+
+    def handle(self):
+        buf = b''
+        while True:
+            data = self.request.recv(1 << 16)
+            if not data:
+                return
+            buf += data
+
+            # Execute every complete command received so far
+            replies = []
+            pos = 0
+            while pos < len(buf):
+                command, pos = parse_command(buf, pos)
+                if command is None:
+                    break
+                if command:
+                    replies.append(encode_reply(
+                        self.server.execute(command)))
+            buf = buf[pos:]
+
+            if replies:
+                self.request.sendall(b''.join(replies))
+
+
+class KeyValueServer(socketserver.ThreadingTCPServer):
+    """Threaded RESP server holding its keys in memory"""
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int]):
+        super().__init__(address, KeyValueHandler)
+        self.data = {}
+        self.expires = {}
+        self.lock = threading.Lock()
+
+    def lookup(self, key: bytes) -> Optional[bytes]:
+        """Return the value of `key`, dropping it if expired"""
+        expires_at = self.expires.get(key)
+        if expires_at is not None and time.monotonic() >= expires_at:
+            del self.data[key]
+            del self.expires[key]
+        return self.data.get(key)
+
+    def execute(self, command: List[bytes]):
+        """Execute one command and return its reply"""
+        name = command[0].upper()
+        args = command[1:]
+        with self.lock:
+            try:
+                if name == b'PING':
+                    return args[0] if args else 'PONG'
+                if name == b'GET':
+                    return self.lookup(args[0])
+                if name == b'MGET':
+                    return [self.lookup(key) for key in args]
+                if name == b'SET':
+                    key, value = args[0], args[1]
+                    self.data[key] = value
+                    self.expires.pop(key, None)
+                    options = [arg.upper() for arg in args[2:]]
+                    if b'EX' in options:
+                        ttl = int(args[2 + options.index(b'EX') + 1])
+                        self.expires[key] = time.monotonic() + ttl
+                    elif b'PX' in options:
+                        ttl = int(args[2 + options.index(b'PX') + 1])
+                        self.expires[key] = time.monotonic() + ttl / 1000
+                    return 'OK'
+                if name == b'DEL':
+                    count = 0
+                    for key in args:
+                        if self.lookup(key) is not None:
+                            del self.data[key]
+                            self.expires.pop(key, None)
+                            count += 1
+                    return count
+                if name == b'EXISTS':
+                    return sum(self.lookup(key) is not None for key in args)
+                if name == b'DBSIZE':
+                    return len(self.data)
+                if name == b'FLUSHDB':
+                    self.data.clear()
+                    self.expires.clear()
+                    return 'OK'
+                return ValueError("unknown command '{}'".format(
+                    name.decode('utf-8', 'replace')))
+            except (IndexError, ValueError) as e:
+                return ValueError("wrong arguments: {}".format(e))
+
+
+def serve_in_thread(host: str = '127.0.0.1',
+                    port: int = 0) -> KeyValueServer:
+    """Start a KeyValueServer on a daemon thread and return it,
+    e.g. for tests; port 0 picks a free port (see server_address)
+    """
+    server = KeyValueServer((host, port))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    host = getenv("KV_HOST", "127.0.0.1")
+    port = int(getenv("KV_PORT", "6380"))
+    with KeyValueServer((host, port)) as server:
+        server.serve_forever()
@@ -1,7 +1,10 @@
 #!/usr/bin/env python3
 """The SessionAuth class"""
 from api.v1.auth.auth import Auth
+from api.v1.auth.session_backends import get_session_backend
+from api.v1.auth.session_store import SessionBackend
 from models.user import User
+from os import getenv
 from typing import TypeVar
 import uuid
 
@@ -10,8 +13,26 @@ class SessionAuth(Auth):
     """Class to manage the Session Authentication for our API
     """
 
-    # Map users IDs to sessions IDs
-    user_id_by_session_id = {}
+    def __init__(self):
+        """Set up the store mapping sessions IDs to users IDs
+        """
+        self.user_id_by_session_id = self.session_backend()
+
+    def session_backend(self, ttl: float = 0) -> SessionBackend:
+        """Return a store of sessions expiring after `ttl` seconds,
+        from the backend named by SESSION_BACKEND and
+        holding at most SESSION_STORE_CAPACITY sessions
+        """
+        try:
+            capacity = int(getenv('SESSION_STORE_CAPACITY', 100000))
+        except ValueError:
+            capacity = 100000
+        return get_session_backend(ttl, capacity)
+
+    def session_stats(self) -> dict:
+        """Return statistics about the sessions, from their store
+        """
+        return self.user_id_by_session_id.stats()
 
     def create_session(self, user_id: str = None) -> str:
         """Create and return a Session ID for a `user_id`
@@ -75,5 +96,4 @@ class SessionAuth(Auth):
             return False
 
         # Delete it from user_id_by_session_id and return True
-        del self.user_id_by_session_id[session_id]
-        return True
+        return self.user_id_by_session_id.delete(session_id)
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""Session backends shared between processes, and the factory choosing
+the backend of SessionAuth from the SESSION_BACKEND environment variable:
+- memory: SessionStore, private to each process (default)
+- shm: SharedMemoryBackend, a SQLite database in shared memory
+  (SESSION_SHM_PATH) for all workers of one host
+- kv: KeyValueBackend, a Redis-protocol server (SESSION_BACKEND_URL)
+  for all workers of all hosts
+"""
+from api.v1.auth.session_store import SessionBackend, SessionStore
+from datetime import datetime
+import json
+import os
+import socket
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Iterable, List, Tuple
+from urllib.parse import urlparse
+
+
+def encode_value(value) -> str:
+    """Serialize a session value to JSON, datetimes included"""
+
+    def default(obj):
+        if isinstance(obj, datetime):
+            return {'__datetime__': obj.isoformat()}
+        raise TypeError(f'{type(obj).__name__} is not JSON serializable')
+
+    return json.dumps(value, default=default)
+
+
+def decode_value(text: str):
+    """Deserialize a session value serialized by encode_value"""
+
+    def object_hook(obj: dict):
+        if list(obj) == ['__datetime__']:
+            return datetime.fromisoformat(obj['__datetime__'])
+        return obj
+
+    return json.loads(text, object_hook=object_hook)
+
+
+class SharedMemoryBackend(SessionBackend):
+    """Sessions kept in a SQLite database, by default in /dev/shm,
+    so every worker process of the host sees the same sessions
+    """
+
+    SCHEMA = [
+        'CREATE TABLE IF NOT EXISTS sessions ('
+        'session_id TEXT PRIMARY KEY, value TEXT, created_at REAL)',
+        'CREATE INDEX IF NOT EXISTS sessions_created_at '
+        'ON sessions (created_at)',
+    ]
+
+    def __init__(self, path: str, ttl: float = 0, capacity: int = 0):
+        self.path = path
+        self.ttl = ttl
+        self.capacity = capacity
+        self.expired = 0
+        self.evicted = 0
+        self.__local = threading.local()
+        with self.connection() as connection:
+            for statement in self.SCHEMA:
+                connection.execute(statement)
+
+    def connection(self) -> sqlite3.Connection:
+        """Return the connection of this thread, opening a new one
+        after a fork
+        """
+        local = self.__local
+        if getattr(local, 'pid', None) != os.getpid():
+            local.connection = sqlite3.connect(self.path, timeout=5,
+                                               isolation_level=None)
+            local.connection.execute('PRAGMA journal_mode=WAL')
+            local.connection.execute('PRAGMA synchronous=OFF')
+            local.pid = os.getpid()
+        return local.connection
+
+    def __oldest_live(self) -> float:
+        """Return the creation time before which sessions are expired"""
+        return time.time() - self.ttl if self.ttl > 0 else float('-inf')
+
+    def get(self, session_id: str, default=None):
+        if not isinstance(session_id, str):
+            return default
+        row = self.connection().execute(
+            'SELECT value FROM sessions WHERE session_id = ? '
+            'AND created_at > ?',
+            (session_id, self.__oldest_live())).fetchone()
+        return default if row is None else decode_value(row[0])
+
+    def get_many(self, session_ids: Iterable[str]) -> List:
+        session_ids = [session_id if isinstance(session_id, str) else ''
+                       for session_id in session_ids]
+        rows = self.connection().execute(
+            'SELECT session_id, value FROM sessions WHERE session_id IN '
+            '({}) AND created_at > ?'.format(','.join('?' * len(session_ids))),
+            session_ids + [self.__oldest_live()]).fetchall()
+        values = {session_id: value for session_id, value in rows}
+        return [decode_value(values[session_id]) if session_id in values
+                else None for session_id in session_ids]
+
+    def set(self, session_id: str, value) -> None:
+        connection = self.connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            # Evict expired sessions, then the oldest ones if full
+            self.expired += connection.execute(
+                'DELETE FROM sessions WHERE created_at <= ?',
+                (self.__oldest_live(),)).rowcount
+            if self.capacity > 0:
+                count = connection.execute(
+                    'SELECT COUNT(*) FROM sessions').fetchone()[0]
+                if count >= self.capacity:
+                    self.evicted += connection.execute(
+                        'DELETE FROM sessions WHERE session_id IN '
+                        '(SELECT session_id FROM sessions '
+                        'ORDER BY created_at LIMIT ?)',
+                        (count - self.capacity + 1,)).rowcount
+            connection.execute(
+                'INSERT OR REPLACE INTO sessions VALUES (?, ?, ?)',
+                (session_id, encode_value(value), time.time()))
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+
+    def delete(self, session_id: str) -> bool:
+        return self.connection().execute(
+            'DELETE FROM sessions WHERE session_id = ?',
+            (session_id,)).rowcount > 0
+
+    def stats(self) -> dict:
+        size = self.connection().execute(
+            'SELECT COUNT(*) FROM sessions WHERE created_at > ?',
+            (self.__oldest_live(),)).fetchone()[0]
+        return {'size': size, 'capacity': self.capacity,
+                'expired': self.expired, 'evicted': self.evicted}
+
+
+class RespConnection:
+    """Minimal client of the Redis protocol, sending commands in pipelines
+    """
+
+    def __init__(self, host: str, port: int, timeout: float = 5):
+        self.sock = socket.create_connection((host, port), timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.reader = self.sock.makefile('rb')
+
+    @staticmethod
+    def encode(command: Tuple) -> bytes:
+        """Encode a command as a RESP array of bulk strings"""
+        parts = [b'*%d\r\n' % len(command)]
+        for arg in command:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode('utf-8')
+            parts.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+        return b''.join(parts)
+
+    def read_reply(self):
+        """Read one reply from the server"""
+        line = self.reader.readline()
+        if not line:
+            raise ConnectionError('Connection closed by the server')
+        kind, payload = line[:1], line[1:-2]
+        if kind == b'+':
+            return payload.decode('utf-8')
+        if kind == b'-':
+            raise RuntimeError(payload.decode('utf-8'))
+        if kind == b':':
+            return int(payload)
+        if kind == b'$':
+            length = int(payload)
+            if length < 0:
+                return None
+            return self.reader.read(length + 2)[:-2]
+        if kind == b'*':
+            return [self.read_reply() for _ in range(int(payload))]
+        raise ConnectionError('Invalid reply from the server')
+
+    def execute_many(self, commands: List[Tuple]) -> List:
+        """Send all `commands` at once and return their replies"""
+        self.sock.sendall(b''.join(self.encode(c) for c in commands))
+        return [self.read_reply() for _ in commands]
+
+    def close(self) -> None:
+        """Close the connection"""
+        self.reader.close()
+        self.sock.close()
+
+
+class KeyValueBackend(SessionBackend):
+    """Sessions kept in a Redis-protocol key-value server, shared by
+    every worker of every host; keys expire on the server, whose own
+    memory policy plays the role of `capacity`
+    """
+
+    PREFIX = 'session:'
+
+    def __init__(self, host: str, port: int, ttl: float = 0,
+                 capacity: int = 0):
+        self.host = host
+        self.port = port
+        self.ttl = ttl
+        self.capacity = capacity
+        self.__local = threading.local()
+
+    def execute_many(self, commands: List[Tuple]) -> List:
+        """Run `commands` in one pipeline on the connection of this thread,
+        reconnecting once if it was lost or opened before a fork
+        """
+        local = self.__local
+        for attempt in range(2):
+            if getattr(local, 'pid', None) != os.getpid():
+                local.connection = RespConnection(self.host, self.port)
+                local.pid = os.getpid()
+            try:
+                return local.connection.execute_many(commands)
+            except (ConnectionError, OSError):
+                local.connection.close()
+                local.pid = None
+                if attempt:
+                    raise
+
+    def get(self, session_id: str, default=None):
+        if not isinstance(session_id, str):
+            return default
+        value, = self.execute_many([('GET', self.PREFIX + session_id)])
+        return default if value is None else decode_value(value)
+
+    def get_many(self, session_ids: Iterable[str]) -> List:
+        session_ids = list(session_ids)
+        values = iter(self.execute_many([('GET', self.PREFIX + session_id)
+                                         for session_id in session_ids
+                                         if isinstance(session_id, str)]))
+        result = []
+        for session_id in session_ids:
+            value = next(values) if isinstance(session_id, str) else None
+            result.append(None if value is None else decode_value(value))
+        return result
+
+    def set(self, session_id: str, value) -> None:
+        command = ('SET', self.PREFIX + session_id, encode_value(value))
+        if self.ttl > 0:
+            command += ('EX', int(self.ttl))
+        self.execute_many([command])
+
+    def delete(self, session_id: str) -> bool:
+        if not isinstance(session_id, str):
+            return False
+        count, = self.execute_many([('DEL', self.PREFIX + session_id)])
+        return count > 0
+
+    def stats(self) -> dict:
+        size, = self.execute_many([('DBSIZE',)])
+        return {'size': size}
+
+
+def get_session_backend(ttl: float = 0,
+                        capacity: int = 0) -> SessionBackend:
+    """Return the session backend named by SESSION_BACKEND"""
+    backend = os.getenv('SESSION_BACKEND', 'memory')
+
+    if backend == 'shm':
+        directory = '/dev/shm' if os.path.isdir('/dev/shm') \
+            else tempfile.gettempdir()
+        path = os.getenv('SESSION_SHM_PATH',
+                         os.path.join(directory, 'api_sessions.db'))
+        return SharedMemoryBackend(path, ttl, capacity)
+
+    if backend == 'kv':
+        url = urlparse(os.getenv('SESSION_BACKEND_URL',
+                                 'redis://127.0.0.1:6380'))
+        return KeyValueBackend(url.hostname or '127.0.0.1',
+                               url.port or 6380, ttl, capacity)
+
+    return SessionStore(ttl, capacity)
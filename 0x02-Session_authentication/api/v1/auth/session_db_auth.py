@@ -11,6 +11,17 @@ class SessionDBAuth(SessionExpAuth):
     with Expiration time and File storage for sessions IDs
     """
 
+    def session_backend(self, ttl: float = 0) -> None:
+        """No store: sessions are kept as UserSession records
+        """
+        return None
+
+    def session_stats(self) -> dict:
+        """Return statistics about the sessions: the number of UserSession
+        records, including expired ones not reaped yet
+        """
+        return {'size': UserSession.count()}
+
     def create_session(self, user_id: str = None) -> str:
         """Create and return a Session ID for a `user_id`
         """
@@ -29,8 +40,10 @@ class SessionDBAuth(SessionExpAuth):
         # Return the Session Id
         return session_id
 
-    def user_id_for_session_id(self, session_id: str = None) -> str:
-        """Return a User ID based on a Session ID by querying UserSession DB
+    def user_session_for_session_id(self,
+                                    session_id: str = None) -> UserSession:
+        """Return the live UserSession of a Session ID, found through
+        the session_id index of UserSession, or None
         """
 
         # Get the UserSession if it exists within UserSession DB
@@ -39,9 +52,9 @@ class SessionDBAuth(SessionExpAuth):
         except BaseException:
             return None
 
-        # Return user_id directly if there is no expiration time
+        # Return it directly if there is no expiration time
         if self.session_duration <= 0:
-            return user_session.user_id
+            return user_session
 
         # Handle expiration time
 
@@ -54,7 +67,15 @@ class SessionDBAuth(SessionExpAuth):
         if datetime.utcnow() > user_session.created_at + exp_time:
             return None
 
-        # Return the User ID for this session
+        # Return the UserSession
+        return user_session
+
+    def user_id_for_session_id(self, session_id: str = None) -> str:
+        """Return a User ID based on a Session ID by querying UserSession DB
+        """
+        user_session = self.user_session_for_session_id(session_id)
+        if user_session is None:
+            return None
         return user_session.user_id
 
     def destroy_session(self, request=None) -> bool:
@@ -69,11 +90,11 @@ class SessionDBAuth(SessionExpAuth):
             return False
 
         # Verify it is linked to a user
-        if not self.user_id_for_session_id(session_id):
+        user_session = self.user_session_for_session_id(session_id)
+        if not user_session or not user_session.user_id:
             return False
 
         # Delete it from UserSession DB and return True
-        user_session = UserSession.search({'session_id': session_id})[0]
         user_session.remove()
 
         return True
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 """The SessionExpAuth class"""
 from api.v1.auth.session_auth import SessionAuth
+from api.v1.auth.session_store import SessionBackend
 from datetime import datetime, timedelta
 from os import getenv
 from models.user import User
@@ -11,15 +12,21 @@ class SessionExpAuth(SessionAuth):
     with Expiration time for sessions
     """
 
-    # Map sessions IDs to their dictionnaries
-    user_id_by_session_id = {}
-
     def __init__(self):
-        """Set the duration of Expiration time"""
+        """Set the duration of Expiration time, after which sessions
+        are evicted from user_id_by_session_id
+        """
         try:
             self.session_duration = int(getenv('SESSION_DURATION', 0))
         except ValueError:
             self.session_duration = 0
+        super().__init__()
+
+    def session_backend(self, ttl: float = 0) -> SessionBackend:
+        """Return a store of sessions expiring after the duration
+        of Expiration time
+        """
+        return super().session_backend(max(self.session_duration, 0))
 
     def create_session(self, user_id: str = None) -> str:
         """Create and return a Session ID for a `user_id`
@@ -45,12 +52,14 @@ class SessionExpAuth(SessionAuth):
         """Return a User ID based on a Session ID
         """
 
-        # Verify that `session_id` is in user_id_by_session_id
-        if session_id not in self.user_id_by_session_id:
+        # Verify `session_id`'s type
+        if not isinstance(session_id, str):
             return None
 
-        # Get the session dictionnary
-        session_dict = self.user_id_by_session_id[session_id]
+        # Get the session dictionnary if it is in user_id_by_session_id
+        session_dict = self.user_id_by_session_id.get(session_id)
+        if session_dict is None:
+            return None
 
         # Return user_id directly if there is no expiration time
         if self.session_duration <= 0:
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""The SessionReaper class, deleting expired UserSession records
+
+Run a single sweep over the sessions files with:
+$ SESSION_DURATION=60 python3 -m api.v1.auth.session_reaper
+
+The sweep rewrites the sessions files, so it is only safe with the API
+stopped: a running API would write the reaped sessions back on its next
+compaction. It refuses to run while an API holds the sessions lock file.
+"""
+from datetime import datetime, timedelta
+import logging
+from models.base import DATA, LOCK
+from models.user_session import UserSession
+from os import getenv
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class SessionReaper(threading.Thread):
+    """Background thread deleting expired UserSession records every
+    `interval` seconds, by batches of `batch_size` with one journal
+    flush per batch
+    """
+
+    def __init__(self, session_duration: int, interval: float = 60,
+                 batch_size: int = 1000):
+        super().__init__(name='session-reaper', daemon=True)
+        self.session_duration = session_duration
+        self.interval = interval
+        self.batch_size = batch_size
+        self.sweeps = 0
+        self.errors = 0
+        self.reclaimed = 0
+        self.last_reclaimed = 0
+        self.last_duration = 0.0
+        self.stopped = threading.Event()
+
+    def is_expired(self, user_session: UserSession, now: datetime) -> bool:
+        """Check if `user_session` can't be used anymore"""
+        if not isinstance(user_session.created_at, datetime):
+            return True
+        exp_time = timedelta(seconds=self.session_duration)
+        return now > user_session.created_at + exp_time
+
+    def sweep(self) -> int:
+        """Delete all expired sessions and return how many there were"""
+        start = time.perf_counter()
+        reclaimed = 0
+
+        # Sessions never expire without a positive duration
+        if self.session_duration > 0:
+            # Copy the sessions, which request threads keep adding to
+            with LOCK:
+                sessions = list(DATA.get(UserSession.__name__, {}).values())
+            now = datetime.utcnow()
+            expired = [user_session for user_session in sessions
+                       if self.is_expired(user_session, now)]
+            for i in range(0, len(expired), self.batch_size):
+                reclaimed += UserSession.remove_many(
+                    expired[i:i + self.batch_size])
+                UserSession.flush_journal()
+
+        self.sweeps += 1
+        self.reclaimed += reclaimed
+        self.last_reclaimed = reclaimed
+        self.last_duration = time.perf_counter() - start
+        return reclaimed
+
+    def metrics(self) -> dict:
+        """Return the number of sweeps and failed ones, of sessions
+        reclaimed in total and by the last sweep, and the duration
+        of the last sweep
+        """
+        return {'sweeps': self.sweeps, 'errors': self.errors,
+                'reclaimed': self.reclaimed,
+                'last_reclaimed': self.last_reclaimed,
+                'last_duration': self.last_duration}
+
+    def run(self):
+        """Sweep every `interval` seconds until stopped, logging the
+        errors of a sweep instead of dying on them
+        """
+        while not self.stopped.wait(self.interval):
+            try:
+                self.sweep()
+            except Exception:
+                self.errors += 1
+                logger.exception("Sweep of expired sessions failed")
+
+    def stop(self):
+        """Stop sweeping"""
+        self.stopped.set()
+
+
+def main():
+    """Delete the expired sessions from the sessions files once,
+    then compact them
+    """
+    try:
+        session_duration = int(getenv('SESSION_DURATION', 0))
+    except ValueError:
+        session_duration = 0
+    try:
+        batch_size = int(getenv('SESSION_REAPER_BATCH', 1000))
+    except ValueError:
+        batch_size = 1000
+
+    lock_file = UserSession.lock_files(exclusive=True, wait=False)
+    if lock_file is None:
+        sys.exit("The sessions files are in use, stop the API first")
+
+    with lock_file:
+        UserSession.load_from_file()
+        reaper = SessionReaper(session_duration, batch_size=batch_size)
+        reaper.sweep()
+        UserSession.save_to_file()
+
+    metrics = reaper.metrics()
+    print("Reclaimed {} expired sessions in {:.3f}s".format(
+        metrics['reclaimed'], metrics['last_duration']))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""The SessionBackend and SessionStore classes"""
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+import threading
+import time
+from typing import Iterable, List
+
+
+class SessionBackend(ABC):
+    """Interface of the stores mapping sessions IDs to session values
+
+    Subclasses implement get, set and delete, and optionally stats,
+    honouring the `ttl` (seconds, 0 for none) and `capacity` (0 for none)
+    attributes. Lookups of IDs that aren't strings return the default.
+    """
+
+    ttl = 0
+    capacity = 0
+
+    @abstractmethod
+    def get(self, session_id: str, default=None):
+        """Return the value of `session_id`, or `default`"""
+
+    @abstractmethod
+    def set(self, session_id: str, value) -> None:
+        """Store `value` for `session_id`"""
+
+    @abstractmethod
+    def delete(self, session_id: str) -> bool:
+        """Remove `session_id` and return True if it existed"""
+
+    def get_many(self, session_ids: Iterable[str]) -> List:
+        """Return the values of all `session_ids`, None for missing ones"""
+        return [self.get(session_id) for session_id in session_ids]
+
+    def stats(self) -> dict:
+        """Return statistics about the store"""
+        return {}
+
+    def __contains__(self, session_id: str) -> bool:
+        return self.get(session_id, self) is not self
+
+    def __getitem__(self, session_id: str):
+        value = self.get(session_id, self)
+        if value is self:
+            raise KeyError(session_id)
+        return value
+
+    def __setitem__(self, session_id: str, value) -> None:
+        self.set(session_id, value)
+
+    def __delitem__(self, session_id: str) -> None:
+        if not self.delete(session_id):
+            raise KeyError(session_id)
+
+
+class SessionStore(SessionBackend):
+    """In-memory session store with expiration and a capacity cap
+
+    Sessions are kept in insertion order, which is also their expiration
+    order as they all share the same time to live. Expired sessions are
+    evicted from the front on every insertion, so eviction is amortized
+    O(1), and the oldest session makes room when the store is full.
+    """
+
+    def __init__(self, ttl: float = 0, capacity: int = 0):
+        """`ttl` and `capacity` of 0 mean no expiration and no cap"""
+        self.ttl = ttl
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evicted = 0
+        self.__sessions = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def __is_expired(self, created_at: float, now: float) -> bool:
+        """Check if a session created at `created_at` is expired at `now`"""
+        return self.ttl > 0 and now >= created_at + self.ttl
+
+    def evict_expired(self) -> int:
+        """Remove the expired sessions and return how many there were"""
+        now = time.monotonic()
+        count = 0
+        with self.__lock:
+            while self.__sessions:
+                session_id, (created_at, _) = next(iter(
+                    self.__sessions.items()))
+                if not self.__is_expired(created_at, now):
+                    break
+                del self.__sessions[session_id]
+                count += 1
+            self.expired += count
+        return count
+
+    def set(self, session_id: str, value) -> None:
+        """Store `value` for `session_id`, evicting expired sessions,
+        then the oldest ones if the store is full
+        """
+        self.evict_expired()
+        with self.__lock:
+            self.__sessions.pop(session_id, None)
+            while 0 < self.capacity <= len(self.__sessions):
+                self.__sessions.popitem(last=False)
+                self.evicted += 1
+            self.__sessions[session_id] = (time.monotonic(), value)
+
+    def get(self, session_id: str, default=None):
+        """Return the value of `session_id`, or `default`
+        if it doesn't exist or is expired
+        """
+        with self.__lock:
+            entry = self.__sessions.get(session_id)
+            if entry is not None and \
+                    self.__is_expired(entry[0], time.monotonic()):
+                del self.__sessions[session_id]
+                self.expired += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            return entry[1]
+
+    def delete(self, session_id: str) -> bool:
+        """Remove `session_id` and return True if it existed"""
+        with self.__lock:
+            return self.__sessions.pop(session_id, None) is not None
+
+    def stats(self) -> dict:
+        """Return the size of the store and its lookup and eviction counts
+        """
+        return {'size': len(self), 'capacity': self.capacity,
+                'hits': self.hits, 'misses': self.misses,
+                'expired': self.expired, 'evicted': self.evicted}
+
+    def __len__(self) -> int:
+        return len(self.__sessions)
@@ -20,9 +20,14 @@ def stats() -> str:
     Return:
       - the number of each objects
     """
+    from api.v1.app import auth, reaper
     from models.user import User
     stats = {}
     stats['users'] = User.count()
+    if hasattr(auth, 'session_stats'):
+        stats['sessions'] = auth.session_stats()
+    if reaper is not None:
+        stats['session_reaper'] = reaper.metrics()
     return jsonify(stats)
 
 
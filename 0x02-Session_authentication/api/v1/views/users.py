@@ -2,18 +2,262 @@
 """ Module of Users views
 """
 from api.v1.views import app_views
-from flask import abort, jsonify, request
+import base64
+from datetime import datetime, timezone
+from flask import (abort, jsonify, make_response, request, Response,
+                   stream_with_context, url_for)
+import hashlib
+from itertools import chain, islice, takewhile
+import json
+from models.base import parse_timestamp
 from models.user import User
+from typing import Iterator, List, Optional, Tuple
+import uuid
+from werkzeug.http import is_resource_modified
+
+# Largest number of users in one page
+MAX_PAGE_SIZE = 1000
+
+# Part of the ETags of listings, which are built from the version of the
+# store: versions restart with the process, so must ETags
+ETAG_EPOCH = uuid.uuid4().hex[:8]
+
+
+def with_validators(response: Response, etag: str,
+                    last_modified: datetime) -> Response:
+    """ Set the ETag and Last-Modified headers of `response`
+    """
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    return response
+
+
+def not_modified(etag: str, last_modified: datetime) -> Optional[Response]:
+    """ Return a 304 response if If-None-Match or If-Modified-Since
+    of the request match `etag` or `last_modified`, None otherwise
+    """
+    if is_resource_modified(request.environ, etag,
+                            last_modified=last_modified):
+        return None
+    return with_validators(Response(status=304), etag, last_modified)
+
+
+def user_validators(user: User) -> Tuple[str, datetime]:
+    """ Return the ETag and Last-Modified of one user, from its ID
+    and the time of its last save
+    """
+    return '{}-{:%Y%m%d%H%M%S%f}'.format(user.id, user.updated_at), \
+        user.updated_at
+
+
+def view_user(user: User) -> Response:
+    """ Return `user` JSON represented with its validators,
+    or a 304 response if the client has it already
+    """
+    etag, last_modified = user_validators(user)
+    response = not_modified(etag, last_modified)
+    if response is None:
+        response = with_validators(jsonify(user.to_json()), etag,
+                                   last_modified)
+    return response
+
+
+def encode_cursor(attribute: str, key: Tuple) -> str:
+    """ Encode the sorted index key of the last user of a page
+    as an opaque cursor
+    """
+    value = [attribute] + [{'$dt': v.isoformat()}
+                           if isinstance(v, datetime) else v for v in key]
+    return base64.urlsafe_b64encode(
+        json.dumps(value).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor: str) -> Tuple[str, Tuple]:
+    """ Decode a cursor made by encode_cursor into the attribute
+    of the index and the key
+    Raise ValueError if it's invalid
+    """
+    try:
+        value = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        if not isinstance(value, list) or len(value) != 3:
+            raise ValueError("Invalid cursor")
+        return value[0], tuple(parse_timestamp(v['$dt'])
+                               if isinstance(v, dict) else v
+                               for v in value[1:])
+    except (KeyError, TypeError, ValueError, UnicodeError):
+        raise ValueError("Invalid cursor")
+
+
+def parse_time_filter(value: str) -> datetime:
+    """ Parse the timestamp of a filter, as UTC without time zone
+    like the timestamps of the models
+    Raise ValueError if it's invalid
+    """
+    timestamp = parse_timestamp(value)
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return timestamp
+
+
+def project(user: User, fields: Optional[List[str]]) -> dict:
+    """ Return `user` JSON represented, with only `fields` if given
+    """
+    user_json = user.to_json()
+    if fields is None:
+        return user_json
+    return {k: user_json[k] for k in fields if k in user_json}
+
+
+def stream_users(users: Iterator[User], fields: Optional[List[str]],
+                 ndjson: bool) -> Iterator[str]:
+    """ Yield users JSON represented as they are serialized,
+    one per line or as the items of one JSON array
+    """
+    if ndjson:
+        for user in users:
+            yield json.dumps(project(user, fields)) + '\n'
+        return
+    separator = '['
+    for user in users:
+        yield separator + json.dumps(project(user, fields))
+        separator = ','
+    yield '[]\n' if separator == '[' else ']\n'
 
 
 @app_views.route('/users', methods=['GET'], strict_slashes=False)
 def view_all_users() -> str:
     """ GET /api/v1/users
+    Query parameters (optional):
+      - fields: comma separated attributes to return, e.g. email,id
+      - email_prefix: only users whose email starts with it
+      - created_after, updated_after: only users created or updated
+        after this timestamp
+      - limit: number of users of the page (up to MAX_PAGE_SIZE)
+      - after: cursor of the page, from the X-Next-Cursor header
+        of the previous one
+      - format: ndjson to stream one user per line,
+        or stream to stream a JSON array
     Return:
-      - list of all User objects JSON represented
+      - list of User objects JSON represented, ordered by email with
+        email_prefix, else by creation or update time with created_after
+        or updated_after, else by ID, with an
+        X-Next-Cursor header if there are more
+      - 304 if If-None-Match or If-Modified-Since match the version
+        of the users store
+      - 400 if a parameter is invalid
     """
-    all_users = [user.to_json() for user in User.all()]
-    return jsonify(all_users)
+    args = request.args
+    limit = args.get('limit')
+    after = args.get('after')
+    output = args.get('format')
+    if output is None and \
+            request.accept_mimetypes.best == 'application/x-ndjson':
+        output = 'ndjson'
+
+    # Answer polling clients before reading any user
+    version, modified_at = User.version()
+    digest = hashlib.sha1('{}|{}'.format(
+        request.query_string.decode('latin-1'), output).encode('utf-8'))
+    etag = 'users-{}-{}-{}'.format(ETAG_EPOCH, version,
+                                   digest.hexdigest()[:16])
+    response = not_modified(etag, modified_at)
+    if response is not None:
+        return response
+
+    fields = args.get('fields')
+    if fields is not None:
+        fields = [f.strip() for f in fields.split(',') if f.strip()]
+
+    if limit is not None:
+        try:
+            limit = int(limit)
+        except ValueError:
+            limit = 0
+        if not 0 < limit <= MAX_PAGE_SIZE:
+            return jsonify({'error': "limit must be between 1 and {}"
+                            .format(MAX_PAGE_SIZE)}), 400
+
+    # Filters, checked on every user read from the index
+    filters = []
+    email_prefix = args.get('email_prefix')
+    if email_prefix is not None:
+        filters.append(lambda user: isinstance(user.email, str) and
+                       user.email.startswith(email_prefix))
+    after_times = {}
+    for attribute in ('created_at', 'updated_at'):
+        name = attribute.replace('_at', '_after')
+        if args.get(name) is None:
+            continue
+        try:
+            after_times[attribute] = parse_time_filter(args.get(name))
+        except ValueError:
+            return jsonify({'error': "{} must be a timestamp like {}"
+                            .format(name, '2017-09-16T12:34:56')}), 400
+    for attribute, timestamp in after_times.items():
+        filters.append(lambda user, a=attribute, t=timestamp:
+                       isinstance(getattr(user, a), datetime) and
+                       getattr(user, a) > t)
+
+    # The first filter given, in the order email_prefix, created_after,
+    # updated_after, picks the index to walk and where to start
+    start, stop = None, None
+    if email_prefix is not None:
+        attribute, start = 'email', (email_prefix,)
+
+        def stop(item):
+            return item[0][0].startswith(email_prefix)
+    elif after_times:
+        attribute = next(iter(after_times))
+        start = (after_times[attribute],)
+    else:
+        attribute = 'id'
+
+    if after is not None:
+        try:
+            cursor_attribute, after = decode_cursor(after)
+            if cursor_attribute != attribute:
+                raise ValueError("Invalid cursor")
+            if start is not None:
+                after = max(start, after)
+        except (TypeError, ValueError):
+            return jsonify({'error': "Invalid cursor"}), 400
+    else:
+        after = start
+
+    # Reading the first chunk also checks the cursor against the index
+    size = limit or MAX_PAGE_SIZE
+    items = User.iter_sorted(attribute, after, size + 1)
+    if stop is not None:
+        items = takewhile(stop, items)
+    items = (item for item in items
+             if all(match(item[1]) for match in filters))
+    try:
+        page = list(islice(items, size + 1))
+    except TypeError:
+        return jsonify({'error': "Invalid cursor"}), 400
+
+    headers = {}
+    if limit is None:
+        page = chain(page, items)
+    elif len(page) > limit:
+        page = page[:limit]
+        cursor = encode_cursor(attribute, page[-1][0])
+        headers['X-Next-Cursor'] = cursor
+        headers['Link'] = '<{}>; rel="next"'.format(url_for(
+            'app_views.view_all_users', **dict(args, after=cursor)))
+
+    users = (user for _, user in page)
+    if output in ('ndjson', 'stream'):
+        ndjson = output == 'ndjson'
+        response = Response(
+            stream_with_context(stream_users(users, fields, ndjson)),
+            headers=headers,
+            mimetype='application/x-ndjson' if ndjson else 'application/json')
+    else:
+        response = make_response(
+            jsonify([project(user, fields) for user in users]), 200, headers)
+    response.vary.add('Accept')
+    return with_validators(response, etag, modified_at)
 
 
 @app_views.route('/users/<user_id>', methods=['GET'], strict_slashes=False)
@@ -22,7 +266,8 @@ def view_one_user(user_id: str = None) -> str:
     Path parameter:
       - User ID
     Return:
-      - User object JSON represented
+      - User object JSON represented, with its ETag and Last-Modified
+      - 304 if If-None-Match or If-Modified-Since match them
       - 404 if the User ID doesn't exist
     """
     if user_id is None:
@@ -33,13 +278,15 @@ def view_one_user(user_id: str = None) -> str:
         if not request.current_user:
             abort(404)
         else:
-            return jsonify(request.current_user.to_json())
+            response = view_user(request.current_user)
+            response.vary.update(('Authorization', 'Cookie'))
+            return response
 
     # Common case
     user = User.get(user_id)
     if user is None:
         abort(404)
-    return jsonify(user.to_json())
+    return view_user(user)
 
 
 @app_views.route('/users/<user_id>', methods=['DELETE'], strict_slashes=False)
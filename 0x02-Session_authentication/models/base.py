@@ -2,36 +2,124 @@
 """ Base module
 """
 from datetime import datetime
-from typing import TypeVar, List, Iterable
+from typing import TypeVar, List, Iterable, Iterator, Optional, TextIO
+from models.index import HashIndex, SortedIndex
 from os import path
+import atexit
+import fcntl
 import json
+import os
+import threading
+import time
 import uuid
 
 
+def env_number(name: str, default, convert=int):
+    """ Return the environment variable `name` converted by `convert`,
+    or `default` if it's missing or invalid
+    """
+    try:
+        return convert(os.getenv(name, default))
+    except ValueError:
+        return default
+
+
 TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"
 DATA = {}
+INDEXES = {}
+
+# Slots of each model class, and marker of a slot not set yet
+SLOTS = {}
+MISSING = object()
+
+# Journal entries written since the last snapshot, by class name,
+# and classes whose journal isn't empty
+JOURNAL_SIZES = {}
+JOURNALED = {}
+
+# A journal is compacted into a snapshot every COMPACTION_INTERVAL seconds,
+# or as soon as it reaches COMPACTION_THRESHOLD entries and COMPACTION_RATIO
+# times the number of objects, so each write pays a constant share of the
+# snapshots whatever the size of the class
+COMPACTION_INTERVAL = env_number('DB_COMPACTION_INTERVAL', 60)
+COMPACTION_THRESHOLD = env_number('DB_COMPACTION_THRESHOLD', 1000)
+COMPACTION_RATIO = env_number('DB_COMPACTION_RATIO', 0.5, float)
+COMPACTION_EVENT = threading.Event()
+COMPACTOR = None
+
+# Values of Base.DURABILITY
+DURABILITIES = ('sync', 'write', 'batch')
+
+# Journal entries of 'batch' classes not written yet, by class name,
+# flushed every FLUSH_INTERVAL seconds or once FLUSH_THRESHOLD are pending
+PENDING = {}
+FLUSH_INTERVAL = env_number('DB_FLUSH_INTERVAL', 1.0, float)
+FLUSH_THRESHOLD = env_number('DB_FLUSH_THRESHOLD', 100)
+
+# Number of characters read at once when loading a snapshot
+LOAD_CHUNK_SIZE = 1 << 16
+
+# Number of changes of each class since the process started,
+# and time of the last one, used as cache validators
+VERSIONS = {}
+MODIFIED_AT = {}
+STARTED_AT = datetime.utcnow()
+
+# Guards DATA and the files of all classes
+LOCK = threading.RLock()
+
+# Serializes snapshots, which are written without holding LOCK
+SNAPSHOT_LOCK = threading.Lock()
 
 
 class Base():
     """ Base class
     """
 
+    # Fixed schema of all models: their attributes are stored in slots
+    # instead of a per-instance __dict__
+    __slots__ = ('id', 'created_at', 'updated_at')
+
+    # Attributes with a hash index, kept up to date by save() and remove()
+    # and used by search()
+    INDEXED_ATTRIBUTES = ()
+
+    # Attributes with a sorted index, used by search() like hash indexes
+    # and by iter_sorted() to walk objects in order
+    SORTED_ATTRIBUTES = ()
+
+    # How save() and remove() reach the journal:
+    # - 'sync': written and fsynced before returning
+    # - 'write': written before returning (OS crash may lose it)
+    # - 'batch': buffered and written behind, by FLUSH_INTERVAL
+    #   or FLUSH_THRESHOLD (process crash may lose it)
+    DURABILITY = 'write'
+
+    def __init_subclass__(cls, **kwargs):
+        """ Reject a DURABILITY that isn't one of DURABILITIES,
+        rather than silently treating it as 'write'
+        """
+        super().__init_subclass__(**kwargs)
+        if cls.DURABILITY not in DURABILITIES:
+            raise ValueError("{}.DURABILITY must be one of {}, not {!r}"
+                             .format(cls.__name__, ', '.join(DURABILITIES),
+                                     cls.DURABILITY))
+
     def __init__(self, *args: list, **kwargs: dict):
         """ Initialize a Base instance
         """
         s_class = str(self.__class__.__name__)
         if DATA.get(s_class) is None:
             DATA[s_class] = {}
+            self.__class__.build_indexes()
 
         self.id = kwargs.get('id', str(uuid.uuid4()))
         if kwargs.get('created_at') is not None:
-            self.created_at = datetime.strptime(kwargs.get('created_at'),
-                                                TIMESTAMP_FORMAT)
+            self.created_at = parse_timestamp(kwargs.get('created_at'))
         else:
             self.created_at = datetime.utcnow()
         if kwargs.get('updated_at') is not None:
-            self.updated_at = datetime.strptime(kwargs.get('updated_at'),
-                                                TIMESTAMP_FORMAT)
+            self.updated_at = parse_timestamp(kwargs.get('updated_at'))
         else:
             self.updated_at = datetime.utcnow()
 
@@ -48,58 +136,283 @@ class Base():
         """ Convert the object a JSON dictionary
         """
         result = {}
-        for key, value in self.__dict__.items():
+        for key in self.attributes():
             if not for_serialization and key[0] == '_':
                 continue
+            value = getattr(self, key, MISSING)
+            if value is MISSING:
+                continue
             if type(value) is datetime:
                 result[key] = value.strftime(TIMESTAMP_FORMAT)
             else:
                 result[key] = value
         return result
 
+    def attributes(self) -> tuple:
+        """ Return the names of the attributes of the object: the slots
+        of its class hierarchy, then the keys of its __dict__ if any
+        """
+        cls = self.__class__
+        slots = SLOTS.get(cls)
+        if slots is None:
+            slots = []
+            for klass in reversed(cls.__mro__):
+                declared = klass.__dict__.get('__slots__', ())
+                if isinstance(declared, str):
+                    declared = (declared,)
+                slots.extend(s for s in declared
+                             if s not in ('__dict__', '__weakref__'))
+            slots = SLOTS[cls] = tuple(slots)
+        if not hasattr(self, '__dict__'):
+            return slots
+        return slots + tuple(self.__dict__)
+
     @classmethod
     def load_from_file(cls):
-        """ Load all objects from file
+        """ Load all objects from file: the snapshot first,
+        then the changes recorded in the journal since then
         """
         s_class = cls.__name__
         file_path = ".db_{}.json".format(s_class)
         DATA[s_class] = {}
-        if not path.exists(file_path):
-            return
+        JOURNAL_SIZES[s_class] = 0
+        PENDING.pop(s_class, None)
+
+        if path.exists(file_path):
+            with open(file_path, 'r') as f:
+                for obj_id, obj_json in iter_json_items(f):
+                    DATA[s_class][obj_id] = cls(**obj_json)
+
+        # Replay the journal rotated by an interrupted snapshot, if any,
+        # then the current one; entries hold whole objects, so replaying
+        # ones the snapshot already includes is harmless
+        torn = False
+        for journal_path in (cls.rotated_journal_path(), cls.journal_path()):
+            if not path.exists(journal_path):
+                continue
+            with open(journal_path, 'r') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Torn last entry of an interrupted write
+                        torn = True
+                        break
+                    if entry['op'] == 'save':
+                        obj = cls(**entry['obj'])
+                        DATA[s_class][obj.id] = obj
+                    else:
+                        DATA[s_class].pop(entry['id'], None)
+                    JOURNAL_SIZES[s_class] += 1
+        if JOURNAL_SIZES[s_class] > 0:
+            JOURNALED[s_class] = cls
+        cls.build_indexes()
+        cls.touch()
+
+        # Don't append new entries after a torn one
+        if torn:
+            cls.save_to_file()
+
+    @classmethod
+    def build_indexes(cls) -> dict:
+        """ Build the indexes of INDEXED_ATTRIBUTES from all objects
+        """
+        s_class = cls.__name__
+        indexes = {attr: HashIndex(attr) for attr in cls.INDEXED_ATTRIBUTES}
+        indexes.update((attr, SortedIndex(attr))
+                       for attr in cls.SORTED_ATTRIBUTES)
+        objs = DATA.get(s_class, {}).values()
+        for index in indexes.values():
+            index.build(objs)
+        INDEXES[s_class] = indexes
+        return indexes
+
+    @classmethod
+    def indexes(cls) -> dict:
+        """ Return the indexes of the class by attribute
+        """
+        indexes = INDEXES.get(cls.__name__)
+        if indexes is None:
+            indexes = cls.build_indexes()
+        return indexes
+
+    @classmethod
+    def touch(cls):
+        """ Record a change of the objects of the class
+        """
+        s_class = cls.__name__
+        with LOCK:
+            VERSIONS[s_class] = VERSIONS.get(s_class, 0) + 1
+            MODIFIED_AT[s_class] = datetime.utcnow()
+
+    @classmethod
+    def version(cls) -> tuple:
+        """ Return the number of changes of the objects of the class
+        since the process started, and the time of the last one
+        """
+        s_class = cls.__name__
+        with LOCK:
+            return (VERSIONS.get(s_class, 0),
+                    MODIFIED_AT.get(s_class, STARTED_AT))
+
+    @classmethod
+    def journal_path(cls) -> str:
+        """ Return the path of the journal of the class
+        """
+        return ".db_{}.journal".format(cls.__name__)
 
-        with open(file_path, 'r') as f:
-            objs_json = json.load(f)
-            for obj_id, obj_json in objs_json.items():
-                DATA[s_class][obj_id] = cls(**obj_json)
+    @classmethod
+    def rotated_journal_path(cls) -> str:
+        """ Return the path the journal of the class is moved to
+        while a snapshot is written
+        """
+        return "{}.old".format(cls.journal_path())
+
+    @classmethod
+    def lock_files(cls, exclusive: bool = False,
+                   wait: bool = True) -> Optional[TextIO]:
+        """ Lock the files of the class against other processes,
+        and return the open lock file holding the lock until closed
+
+        Processes serving the files share the lock, and a process
+        rewriting them while nothing serves them takes it exclusively.
+        Without `wait`, return None if another process holds it.
+        """
+        lock_file = open(".db_{}.lock".format(cls.__name__), 'a')
+        operation = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+        if not wait:
+            operation |= fcntl.LOCK_NB
+        try:
+            fcntl.flock(lock_file, operation)
+        except BlockingIOError:
+            lock_file.close()
+            return None
+        except BaseException:
+            lock_file.close()
+            raise
+        return lock_file
 
     @classmethod
     def save_to_file(cls):
-        """ Save all objects to file
+        """ Save all objects to file as a new snapshot,
+        and empty the journal it now includes
+
+        Only the copy of the objects and the rotation of the journal
+        hold LOCK: the snapshot is written and fsynced outside of it,
+        while new entries go to a fresh journal
         """
         s_class = cls.__name__
         file_path = ".db_{}.json".format(s_class)
-        objs_json = {}
-        for obj_id, obj in DATA[s_class].items():
-            objs_json[obj_id] = obj.to_json(True)
+        with SNAPSHOT_LOCK:
+            with LOCK:
+                objs_json = {}
+                for obj_id, obj in DATA[s_class].items():
+                    objs_json[obj_id] = obj.to_json(True)
+
+                # Move the journal aside, after a previous rotation
+                # left by a failed snapshot if any
+                cls.flush_journal()
+                rotated_path = cls.rotated_journal_path()
+                if path.exists(cls.journal_path()):
+                    if path.exists(rotated_path):
+                        with open(cls.journal_path(), 'r') as src, \
+                                open(rotated_path, 'a') as dst:
+                            dst.write(src.read())
+                        os.remove(cls.journal_path())
+                    else:
+                        os.replace(cls.journal_path(), rotated_path)
+                JOURNAL_SIZES[s_class] = 0
+                JOURNALED.pop(s_class, None)
+
+            # Replace the snapshot atomically
+            tmp_path = "{}.tmp".format(file_path)
+            with open(tmp_path, 'w') as f:
+                json.dump(objs_json, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, file_path)
+
+            if path.exists(rotated_path):
+                os.remove(rotated_path)
 
-        with open(file_path, 'w') as f:
-            json.dump(objs_json, f)
+    @classmethod
+    def append_to_journal(cls, entries: List[dict]):
+        """ Record `entries` at the end of the journal of the class,
+        following its DURABILITY
+        """
+        s_class = cls.__name__
+        with LOCK:
+            pending = PENDING.setdefault(s_class, [])
+            pending.extend(entries)
+            if cls.DURABILITY != 'batch' or len(pending) >= FLUSH_THRESHOLD:
+                cls.flush_journal()
+            JOURNAL_SIZES[s_class] = \
+                JOURNAL_SIZES.get(s_class, 0) + len(entries)
+            JOURNALED[s_class] = cls
+            if JOURNAL_SIZES[s_class] >= max(
+                    COMPACTION_THRESHOLD,
+                    COMPACTION_RATIO * len(DATA.get(s_class, ()))):
+                COMPACTION_EVENT.set()
+        start_compactor()
+
+    @classmethod
+    def flush_journal(cls):
+        """ Write the pending entries of the class to its journal
+        """
+        with LOCK:
+            pending = PENDING.pop(cls.__name__, None)
+            if not pending:
+                return
+            with open(cls.journal_path(), 'a') as f:
+                f.write(''.join(json.dumps(e) + '\n' for e in pending))
+                if cls.DURABILITY == 'sync':
+                    f.flush()
+                    os.fsync(f.fileno())
 
     def save(self):
         """ Save current object
         """
         s_class = self.__class__.__name__
-        self.updated_at = datetime.utcnow()
-        DATA[s_class][self.id] = self
-        self.__class__.save_to_file()
+        with LOCK:
+            self.updated_at = datetime.utcnow()
+            DATA[s_class][self.id] = self
+            for index in self.__class__.indexes().values():
+                index.add(self)
+            self.__class__.append_to_journal(
+                [{'op': 'save', 'obj': self.to_json(True)}])
+            self.__class__.touch()
 
     def remove(self):
         """ Remove object
         """
         s_class = self.__class__.__name__
-        if DATA[s_class].get(self.id) is not None:
-            del DATA[s_class][self.id]
-            self.__class__.save_to_file()
+        with LOCK:
+            if DATA[s_class].get(self.id) is not None:
+                del DATA[s_class][self.id]
+                for index in self.__class__.indexes().values():
+                    index.discard(self.id)
+                self.__class__.append_to_journal(
+                    [{'op': 'remove', 'id': self.id}])
+                self.__class__.touch()
+
+    @classmethod
+    def remove_many(cls, objs: Iterable[TypeVar('Base')]) -> int:
+        """ Remove objects with a single journal write,
+        and return how many were removed
+        """
+        s_class = cls.__name__
+        entries = []
+        with LOCK:
+            indexes = cls.indexes().values()
+            for obj in objs:
+                if DATA[s_class].pop(obj.id, None) is not None:
+                    for index in indexes:
+                        index.discard(obj.id)
+                    entries.append({'op': 'remove', 'id': obj.id})
+            if entries:
+                cls.append_to_journal(entries)
+                cls.touch()
+        return len(entries)
 
     @classmethod
     def count(cls) -> int:
@@ -121,11 +434,45 @@ class Base():
         s_class = cls.__name__
         return DATA[s_class].get(id)
 
+    @classmethod
+    def iter_sorted(cls, attribute: str, after: tuple = None,
+                    chunk_size: int = 1000) -> Iterator[tuple]:
+        """ Yield (key, object) pairs in the order of the sorted index
+        on `attribute`, starting right after the key `after`
+
+        Keys are read by chunks of `chunk_size` under the lock, so the
+        walk is safe while objects are saved or removed concurrently
+        Raise ValueError if `attribute` has no sorted index
+        """
+        index = cls.indexes().get(attribute)
+        if not isinstance(index, SortedIndex):
+            raise ValueError("{} has no sorted index on {}".format(
+                cls.__name__, attribute))
+        while True:
+            with LOCK:
+                items = index.range(after, chunk_size)
+            if len(items) == 0:
+                return
+            yield from items
+            after = items[-1][0]
+
     @classmethod
     def search(cls, attributes: dict = {}) -> List[TypeVar('Base')]:
         """ Search all objects with matching attributes
+
+        Candidates come from the index of the first indexed attribute,
+        so they reflect values as of the last save() of each object
         """
         s_class = cls.__name__
+        objs = DATA[s_class].values()
+        indexes = cls.indexes()
+        for k, v in attributes.items():
+            if k in indexes:
+                try:
+                    objs = indexes[k].lookup(v)
+                    break
+                except TypeError:
+                    continue
 
         def _search(obj):
             if len(attributes) == 0:
@@ -135,4 +482,116 @@ class Base():
                     return False
             return True
 
-        return list(filter(_search, DATA[s_class].values()))
+        return list(filter(_search, objs))
+
+
+def compact_all():
+    """ Snapshot every class having changes in its journal
+    """
+    for cls in list(JOURNALED.values()):
+        cls.save_to_file()
+
+
+@atexit.register
+def flush_all():
+    """ Write the pending entries of every class to its journal
+    """
+    with LOCK:
+        for cls in list(JOURNALED.values()):
+            cls.flush_journal()
+
+
+def start_compactor():
+    """ Start the background thread flushing pending entries every
+    FLUSH_INTERVAL seconds, and compacting journals every
+    COMPACTION_INTERVAL seconds, or as soon as one of them
+    reaches COMPACTION_THRESHOLD and COMPACTION_RATIO of its objects
+    """
+    global COMPACTOR
+
+    def compact_forever():
+        last_compaction = time.monotonic()
+        while True:
+            compact_now = COMPACTION_EVENT.wait(FLUSH_INTERVAL)
+            COMPACTION_EVENT.clear()
+            flush_all()
+            if compact_now or \
+                    time.monotonic() - last_compaction >= COMPACTION_INTERVAL:
+                compact_all()
+                last_compaction = time.monotonic()
+
+    with LOCK:
+        if COMPACTOR is None:
+            COMPACTOR = threading.Thread(target=compact_forever,
+                                         name='compactor', daemon=True)
+            COMPACTOR.start()
+
+
+def parse_timestamp(value: str) -> datetime:
+    """ Parse a timestamp in TIMESTAMP_FORMAT, with the much faster
+    ISO parser when the timestamp is in canonical form
+    """
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return datetime.strptime(value, TIMESTAMP_FORMAT)
+
+
+def iter_json_items(f: TextIO,
+                    chunk_size: int = LOAD_CHUNK_SIZE) -> Iterator[tuple]:
+    """ Yield the (key, value) pairs of the JSON object in file `f`
+    one at a time, reading it by chunks of `chunk_size` characters,
+    so the whole object is never held in memory
+    """
+    decoder = json.JSONDecoder()
+    buf, pos, eof, need_more = '', 0, False, False
+    expected = '{'
+    key = None
+
+    while True:
+        # Skip whitespace
+        while pos < len(buf) and buf[pos] in ' \t\n\r':
+            pos += 1
+
+        # Read the next chunk when the buffer runs out
+        if pos == len(buf) or need_more:
+            if eof:
+                raise ValueError("Unexpected end of JSON object")
+            chunk = f.read(chunk_size)
+            eof = len(chunk) == 0
+            buf, pos, need_more = buf[pos:] + chunk, 0, False
+            continue
+
+        char = buf[pos]
+        if expected == '{':
+            if char != '{':
+                raise ValueError("Expecting a JSON object")
+            pos, expected = pos + 1, 'first key'
+        elif expected in ('first key', 'next') and char == '}':
+            return
+        elif expected == 'next':
+            if char != ',':
+                raise ValueError("Expecting ',' delimiter")
+            pos, expected = pos + 1, 'key'
+        elif expected == ':':
+            if char != ':':
+                raise ValueError("Expecting ':' delimiter")
+            pos, expected = pos + 1, 'value'
+        else:
+            # Parse a key or a value, unless it may be cut by the chunk
+            try:
+                value, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                need_more = True
+                continue
+            if end == len(buf) and not eof:
+                need_more = True
+                continue
+            pos = end
+            if expected == 'value':
+                yield key, value
+                expected = 'next'
+            else:
+                key, expected = value, ':'
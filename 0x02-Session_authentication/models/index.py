@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+""" Index module
+"""
+import bisect
+from typing import Dict, Iterable, List, Optional, Tuple, TypeVar
+
+
+class HashIndex():
+    """ Secondary index mapping the values of one attribute
+    to the objects holding them
+    """
+
+    def __init__(self, attribute: str):
+        """ Initialize an empty index on `attribute`
+        """
+        self.attribute = attribute
+        self.__buckets: Dict = {}
+        self.__values: Dict = {}
+
+    def add(self, obj: TypeVar('Base')):
+        """ Index `obj` under its current value of the attribute
+        """
+        self.discard(obj.id)
+        value = getattr(obj, self.attribute, None)
+        try:
+            bucket = self.__buckets.setdefault(value, {})
+        except TypeError:
+            # Unhashable values are left to linear search
+            return
+        bucket[obj.id] = obj
+        self.__values[obj.id] = value
+
+    def build(self, objs: Iterable[TypeVar('Base')]):
+        """ Index all `objs`
+        """
+        for obj in objs:
+            self.add(obj)
+
+    def discard(self, obj_id: str):
+        """ Remove the object with this ID from the index
+        """
+        if obj_id not in self.__values:
+            return
+        value = self.__values.pop(obj_id)
+        bucket = self.__buckets[value]
+        del bucket[obj_id]
+        if len(bucket) == 0:
+            del self.__buckets[value]
+
+    def lookup(self, value) -> List[TypeVar('Base')]:
+        """ Return all objects indexed under `value`
+        Raise TypeError if `value` isn't hashable
+        """
+        return list(self.__buckets.get(value, {}).values())
+
+
+class SortedIndex():
+    """ Secondary index keeping the objects ordered by one attribute,
+    as a sorted list of (value, id) keys searched by bisection
+    """
+
+    def __init__(self, attribute: str):
+        """ Initialize an empty index on `attribute`
+        """
+        self.attribute = attribute
+        self.__keys: List[Tuple] = []
+        self.__entries: Dict = {}
+
+    def add(self, obj: TypeVar('Base')):
+        """ Index `obj` under its current value of the attribute
+        """
+        self.discard(obj.id)
+        value = getattr(obj, self.attribute, None)
+        if value is None:
+            return
+        key = (value, obj.id)
+        try:
+            bisect.insort(self.__keys, key)
+        except TypeError:
+            # Values not comparable with the others are left out
+            return
+        self.__entries[obj.id] = (key, obj)
+
+    def build(self, objs: Iterable[TypeVar('Base')]):
+        """ Index all `objs`, replacing the content of the index,
+        with a single sort instead of one insertion per object
+        """
+        entries = {}
+        for obj in objs:
+            value = getattr(obj, self.attribute, None)
+            if value is not None:
+                entries[obj.id] = ((value, obj.id), obj)
+        try:
+            keys = sorted(key for key, _ in entries.values())
+        except TypeError:
+            # Values not comparable with the others are left out by add
+            self.__keys, self.__entries = [], {}
+            for _, obj in entries.values():
+                self.add(obj)
+            return
+        self.__keys, self.__entries = keys, entries
+
+    def discard(self, obj_id: str):
+        """ Remove the object with this ID from the index
+        """
+        entry = self.__entries.pop(obj_id, None)
+        if entry is None:
+            return
+        del self.__keys[bisect.bisect_left(self.__keys, entry[0])]
+
+    def lookup(self, value) -> List[TypeVar('Base')]:
+        """ Return all objects indexed under `value`
+        Raise TypeError if `value` isn't comparable with the values
+        """
+        objs = []
+        i = bisect.bisect_left(self.__keys, (value,))
+        while i < len(self.__keys) and self.__keys[i][0] == value:
+            objs.append(self.__entries[self.__keys[i][1]][1])
+            i += 1
+        return objs
+
+    def range(self, after: Tuple = None,
+              limit: int = None) -> List[Tuple[Tuple, TypeVar('Base')]]:
+        """ Return up to `limit` (key, object) pairs in order, starting
+        right after the key `after` (from the first key by default)
+        Raise TypeError if `after` isn't comparable with the keys
+        """
+        start = 0 if after is None else \
+            bisect.bisect_right(self.__keys, tuple(after))
+        stop = None if limit is None else start + limit
+        return [(key, self.__entries[key[1]][1])
+                for key in self.__keys[start:stop]]
+
+    def __len__(self) -> int:
+        return len(self.__keys)
@@ -9,6 +9,11 @@ class User(Base):
     """ User class
     """
 
+    __slots__ = ('email', '_password', 'first_name', 'last_name')
+
+    # The sorted index on email also serves lookups by email
+    SORTED_ATTRIBUTES = ('id', 'email', 'created_at', 'updated_at')
+
     def __init__(self, *args: list, **kwargs: dict):
         """ Initialize a User instance
         """
@@ -2,12 +2,21 @@
 """ UserSession module
 """
 from models.base import Base
+from os import getenv
 
 
 class UserSession(Base):
     """ UserSession class to keep track of sessions IDs in a database
     """
 
+    __slots__ = ('session_id', 'user_id')
+
+    INDEXED_ATTRIBUTES = ('session_id',)
+
+    # Logins are frequent: SESSION_DB_DURABILITY=batch writes them behind;
+    # any value but sync, write or batch fails at import
+    DURABILITY = getenv('SESSION_DB_DURABILITY', 'write')
+
     def __init__(self, *args: list, **kwargs: dict):
         """ Initialize a UserSession instance with session ID and its user ID
         """
@@ -15,6 +15,13 @@ app.url_map.strict_slashes = False
 AUTH = Auth()
 
 
+@app.teardown_appcontext
+def remove_db_session(exception=None) -> None:
+    """Close the database session of the request
+    """
+    AUTH.remove_db_session()
+
+
 @app.route('/')
 def index():
     """Root route
@@ -22,6 +29,14 @@ def index():
     return make_response(jsonify({'message': 'Bienvenue'}))
 
 
+@app.route('/stats/')
+def stats():
+    """Return the statistics of the session cache
+    """
+    return make_response(jsonify({'session_cache':
+                                  AUTH.session_cache_stats()}))
+
+
 @app.route('/users/', methods=['POST'])
 def users():
     """End-point to register a user
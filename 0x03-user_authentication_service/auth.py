@@ -1,11 +1,131 @@
 #!/usr/bin/env python3
 """Passwords Encryption/Decryption"""
 import bcrypt
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from db import DB
+import functools
+from itertools import islice
+import os
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm.exc import NoResultFound
+import threading
+import time
+import warnings
+from typing import Iterable, List, Optional, Tuple
 import uuid
 from user import User
 
+# Hash time aimed at by _calibrate_rounds, in milliseconds: cost 12
+# takes about 300ms on our servers, so the default target leaves
+# room for calibration to raise it on faster ones
+TARGET_HASH_MS = 500
+
+# Bounds of the calibrated cost factor: calibration only ever raises
+# the cost above bcrypt's default of 12, and only BCRYPT_ROUNDS can
+# lower it
+MIN_ROUNDS = 12
+MAX_ROUNDS = 16
+
+# Users registered per transaction by register_users
+REGISTER_BATCH = 1000
+
+# Sessions kept by the cache of get_user_from_session_id, and seconds
+# they stay there: a logout done by another process goes unseen by this
+# one for up to SESSION_CACHE_TTL seconds (see README)
+SESSION_CACHE_SIZE = 10000
+SESSION_CACHE_TTL = 5
+
+
+class SessionCache:
+    """Bounded LRU cache mapping session IDs to (user ID, email)
+
+    Every invalidation bumps a generation. Callers take it with
+    generation() before reading a session from the database, and set()
+    skips the session if an invalidation happened meanwhile, as the
+    session read may already be destroyed.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.__generation = 0
+        self.__entries = OrderedDict()
+        self.__session_by_user = {}
+        self.__lock = threading.Lock()
+
+    def get(self, session_id: str) -> Optional[Tuple[int, str]]:
+        """Return the (user ID, email) of `session_id`, or None
+        """
+        with self.__lock:
+            entry = self.__entries.get(session_id)
+            if entry is not None and time.monotonic() >= entry[2]:
+                self.__remove(session_id)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.__entries.move_to_end(session_id)
+            self.hits += 1
+            return entry[0], entry[1]
+
+    def generation(self) -> int:
+        """Return the number of invalidations so far
+        """
+        with self.__lock:
+            return self.__generation
+
+    def set(self, session_id: str, user_id: int, email: str,
+            generation: int) -> None:
+        """Cache the user of `session_id`, read from the database after
+        taking `generation`, unless an invalidation happened since then;
+        evict the least recently used session if the cache is full
+        """
+        if self.maxsize <= 0:
+            return
+        with self.__lock:
+            if generation != self.__generation:
+                return
+            self.__remove(session_id)
+            while len(self.__entries) >= self.maxsize:
+                self.__remove(next(iter(self.__entries)))
+            self.__entries[session_id] = (user_id, email,
+                                          time.monotonic() + self.ttl)
+            self.__session_by_user[user_id] = session_id
+
+    def discard_user(self, user_id: int) -> None:
+        """Forget the session of the user with this ID
+        """
+        with self.__lock:
+            self.__generation += 1
+            session_id = self.__session_by_user.get(user_id)
+            if session_id is not None:
+                self.__remove(session_id)
+
+    def clear(self) -> None:
+        """Forget all sessions
+        """
+        with self.__lock:
+            self.__generation += 1
+            self.__entries.clear()
+            self.__session_by_user.clear()
+
+    def stats(self) -> dict:
+        """Return the size of the cache and its hit and miss counts
+        """
+        return {'size': len(self.__entries), 'maxsize': self.maxsize,
+                'hits': self.hits, 'misses': self.misses}
+
+    def __remove(self, session_id: str) -> None:
+        """Remove `session_id`, with the lock held
+        """
+        entry = self.__entries.pop(session_id, None)
+        if entry is not None and \
+                self.__session_by_user.get(entry[0]) == session_id:
+            del self.__session_by_user[entry[0]]
+
 
 class Auth:
     """Auth class to interact with the authentication database.
@@ -14,6 +134,28 @@ class Auth:
     def __init__(self):
         self._db = DB()
 
+        # Calibrate the bcrypt cost now rather than in the first request
+        _get_rounds()
+
+        # Cache of get_user_from_session_id
+        try:
+            maxsize = int(os.environ.get('SESSION_CACHE_SIZE',
+                                         SESSION_CACHE_SIZE))
+        except ValueError:
+            maxsize = SESSION_CACHE_SIZE
+        try:
+            ttl = float(os.environ.get('SESSION_CACHE_TTL',
+                                       SESSION_CACHE_TTL))
+        except ValueError:
+            ttl = SESSION_CACHE_TTL
+        self._session_cache = SessionCache(maxsize, ttl)
+
+    def remove_db_session(self) -> None:
+        """Close the database session of the current thread,
+        at the end of each request
+        """
+        self._db.remove_session()
+
     def register_user(self, email: str, password: str) -> User:
         """Register a new user in the database
         """
@@ -31,6 +173,54 @@ class Auth:
         # Return it
         return user
 
+    def register_users(self, users: Iterable[Tuple[str, str]],
+                       batch_size: int = REGISTER_BATCH,
+                       max_workers: int = None) -> Tuple[int, List[str]]:
+        """Register (email, password) users by batches of `batch_size`,
+        hashing their passwords in parallel on `max_workers` threads
+
+        Return the number of users created and the emails skipped
+        because they were already registered or repeated
+        """
+        created = 0
+        duplicates = []
+        users = iter(users)
+
+        # bcrypt releases the GIL, so threads hash on every core
+        with ThreadPoolExecutor(max_workers) as executor:
+            while True:
+                batch = list(islice(users, batch_size))
+                if not batch:
+                    break
+
+                # Keep the first occurrence of each email of the batch
+                passwords = {}
+                for email, password in batch:
+                    if email in passwords:
+                        duplicates.append(email)
+                    else:
+                        passwords[email] = password
+
+                # Skip the emails already registered, with one query
+                existing = self._db.existing_emails(passwords)
+                duplicates.extend(e for e in passwords if e in existing)
+                emails = [e for e in passwords if e not in existing]
+
+                # Hash in parallel, then insert in one transaction
+                hashes = executor.map(_hash_password,
+                                      [passwords[e] for e in emails])
+                new_users = list(zip(emails, hashes))
+                try:
+                    created += self._db.add_users(new_users)
+                except IntegrityError:
+                    # Some emails were registered meanwhile
+                    existing = self._db.existing_emails(emails)
+                    duplicates.extend(e for e in emails if e in existing)
+                    created += self._db.add_users(
+                        (e, h) for e, h in new_users if e not in existing)
+
+        return created, duplicates
+
     def valid_login(self, email: str, password: str) -> bool:
         """Check that the credentials are correct
         """
@@ -42,11 +232,16 @@ class Auth:
             return False
 
         # Verify that password is correct
-        if bcrypt.checkpw(password.encode('utf-8'), user.hashed_password):
-            return True
-        else:
+        if not bcrypt.checkpw(password.encode('utf-8'), user.hashed_password):
             return False
 
+        # Rehash it if it was hashed with an outdated cost factor
+        if _needs_rehash(user.hashed_password):
+            self._db.update_user(user.id,
+                                 hashed_password=_hash_password(password))
+
+        return True
+
     def create_session(self, email: str) -> str:
         """Create a session ID for the user with email and return this ID
         """
@@ -57,9 +252,10 @@ class Auth:
         except NoResultFound:
             return None
 
-        # Create and assign session ID
+        # Create and assign session ID, replacing the cached one
         session_id = _generate_uuid()
         self._db.update_user(user.id, session_id=session_id)
+        self._session_cache.discard_user(user.id)
 
         # Return the session ID
         return session_id
@@ -69,11 +265,29 @@ class Auth:
         and returns the corresponding User or None
         """
 
-        # Search and return the user if exists, otherwise return None
+        if session_id is None:
+            return None
+
+        # Return a detached user with the cached ID and email if any
+        cached = self._session_cache.get(session_id)
+        if cached is not None:
+            return User(id=cached[0], email=cached[1])
+
+        # Search and return the user if exists, otherwise return None,
+        # caching it unless its session was invalidated meanwhile
+        generation = self._session_cache.generation()
         try:
-            return self._db.find_user_by(session_id=session_id)
+            user = self._db.find_user_by(session_id=session_id)
         except NoResultFound:
             return None
+        self._session_cache.set(session_id, user.id, user.email, generation)
+        return user
+
+    def session_cache_stats(self) -> dict:
+        """Return the size and hit and miss counts of the cache
+        of get_user_from_session_id
+        """
+        return self._session_cache.stats()
 
     def destroy_session(self, user_id: int) -> None:
         """Destroy the user's session
@@ -87,6 +301,19 @@ class Auth:
         except NoResultFound:
             return None
 
+        finally:
+
+            # Forget the cached session
+            self._session_cache.discard_user(user_id)
+
+    def destroy_sessions(self, user_ids: Iterable[int] = None) -> int:
+        """Destroy the sessions of the users with the given IDs,
+        or of all users, and return how many users there were
+        """
+        count = self._db.update_users(user_ids, session_id=None)
+        self._session_cache.clear()
+        return count
+
     def get_reset_password_token(self, email: str) -> str:
         """Generate reset password token for the user
         """
@@ -130,18 +357,66 @@ class Auth:
         except NoResultFound:
             raise ValueError
 
-        # Update user's password
+        # Update user's password, forgetting the cached session
         hashed_password = _hash_password(password)
         self._db.update_user(user.id,
                              hashed_password=hashed_password,
                              reset_token=None)
+        self._session_cache.discard_user(user.id)
+
+
+def _calibrate_rounds(target_ms: float = TARGET_HASH_MS) -> int:
+    """Return the highest bcrypt cost factor whose hash time
+    on this machine stays within `target_ms`
+    """
+    start = time.perf_counter()
+    bcrypt.hashpw(b'calibration', bcrypt.gensalt(MIN_ROUNDS))
+    elapsed_ms = (time.perf_counter() - start) * 1000
+
+    # The floor is kept even when it misses the target, but not silently
+    if elapsed_ms > target_ms:
+        warnings.warn('bcrypt cost {} takes {:.0f}ms, over the {:.0f}ms '
+                      'target: using it anyway'.format(MIN_ROUNDS, elapsed_ms,
+                                                       target_ms))
+
+    # Each extra round doubles the hash time
+    rounds = MIN_ROUNDS
+    while rounds < MAX_ROUNDS and elapsed_ms * 2 <= target_ms:
+        rounds += 1
+        elapsed_ms *= 2
+    return rounds
+
+
+@functools.lru_cache(maxsize=None)
+def _get_rounds() -> int:
+    """Return the cost factor for new hashes, calibrated once per process
+    against BCRYPT_TARGET_MS, unless BCRYPT_ROUNDS sets it
+    """
+    try:
+        return int(os.environ['BCRYPT_ROUNDS'])
+    except (KeyError, ValueError):
+        pass
+    try:
+        target_ms = float(os.environ.get('BCRYPT_TARGET_MS', TARGET_HASH_MS))
+    except ValueError:
+        target_ms = TARGET_HASH_MS
+    return _calibrate_rounds(target_ms)
+
+
+def _needs_rehash(hashed_password: bytes) -> bool:
+    """Check if `hashed_password` was made with an outdated cost factor
+    """
+    if isinstance(hashed_password, str):
+        hashed_password = hashed_password.encode('utf-8')
+    return int(hashed_password.split(b'$')[2]) < _get_rounds()
 
 
 def _hash_password(password: str) -> bytes:
     """Hash `password` and returns a salted, hashed password,
     which is a byte string
     """
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+    return bcrypt.hashpw(password.encode('utf-8'),
+                         bcrypt.gensalt(_get_rounds()))
 
 
 def _generate_uuid() -> str:
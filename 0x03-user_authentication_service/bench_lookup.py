@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""Benchmark of the user lookups of DB.find_user_by
+
+Fills a fresh database with each number of users, then times lookups
+by email, session_id and reset_token, which stay flat with the indexes:
+$ ./bench_lookup.py 1000 10000 100000 1000000
+"""
+from db import DB
+import os
+import random
+import sys
+import tempfile
+import time
+from user import User
+
+# Numbers of users benchmarked by default
+SIZES = (1000, 10000, 100000, 1000000)
+
+# Lookups timed per column and size
+LOOKUPS = 1000
+
+# Users inserted per statement while filling the database
+INSERT_BATCH = 10000
+
+
+def fill(db: DB, count: int) -> None:
+    """Insert `count` users with a session ID and a reset token each
+    """
+    with db._engine.begin() as connection:
+        for start in range(0, count, INSERT_BATCH):
+            connection.execute(User.__table__.insert(), [
+                {'email': f'user{i}@example.com',
+                 'hashed_password': 'x',
+                 'session_id': f'session-{i}',
+                 'reset_token': f'token-{i}'}
+                for i in range(start, min(start + INSERT_BATCH, count))])
+
+
+def time_lookups(db: DB, count: int, column: str, value: str) -> float:
+    """Return the mean time of LOOKUPS lookups by `column`,
+    in microseconds
+    """
+    ids = [random.randrange(count) for _ in range(LOOKUPS)]
+    start = time.perf_counter()
+    for i in ids:
+        db.find_user_by(**{column: value.format(i)})
+    return (time.perf_counter() - start) / LOOKUPS * 1e6
+
+
+def main(sizes) -> None:
+    """Print the mean lookup time by column for each number of users
+    """
+    print(f'{"users":>10} {"email":>10} {"session_id":>12} '
+          f'{"reset_token":>12}  (us/lookup)')
+    for count in sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            db = DB(url='sqlite:///' + os.path.join(directory, 'bench.db'))
+            fill(db, count)
+            email = time_lookups(db, count, 'email', 'user{}@example.com')
+            session = time_lookups(db, count, 'session_id', 'session-{}')
+            token = time_lookups(db, count, 'reset_token', 'token-{}')
+            print(f'{count:>10} {email:>10.1f} {session:>12.1f} '
+                  f'{token:>12.1f}')
+            db._engine.dispose()
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or SIZES)
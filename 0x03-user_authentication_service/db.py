@@ -1,35 +1,141 @@
 #!/usr/bin/env python3
 """DB module
 """
-from sqlalchemy import create_engine
-from sqlalchemy.exc import InvalidRequestError
+import os
+from sqlalchemy import create_engine, event, func, inspect, insert, \
+    select, update
+from sqlalchemy.engine import make_url, URL
+from sqlalchemy.exc import IntegrityError, InvalidRequestError
 from sqlalchemy.orm.exc import NoResultFound
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import scoped_session, sessionmaker
 from sqlalchemy.orm.session import Session
-from typing import Dict
+from sqlalchemy.pool import StaticPool
+from typing import Dict, Iterable, Set, Tuple
 from user import Base, User
 
 
+# Database used by default
+DB_URL = "sqlite:///a.db"
+
+# Connections kept open by the engine, and extra ones opened under load
+POOL_SIZE = 10
+MAX_OVERFLOW = 20
+
+# Seconds a SQLite connection waits for the write lock of another one
+BUSY_TIMEOUT = 30
+
+# Values bound in one IN clause, under the SQLite limit
+IN_BATCH = 500
+
+
+def _env_int(name: str, default: int) -> int:
+    """Return the integer environment variable `name`, or `default`
+    """
+    try:
+        return int(os.environ[name])
+    except (KeyError, ValueError):
+        return default
+
+
+def _is_memory_db(url: URL) -> bool:
+    """Check if `url` is a SQLite database in memory, which lives
+    and dies with its connection
+    """
+    return url.get_backend_name() == 'sqlite' and \
+        (url.database in (None, '', ':memory:') or
+         url.query.get('mode') == 'memory')
+
+
+def _set_sqlite_pragmas(connection, connection_record) -> None:
+    """Switch a new SQLite connection to WAL mode, where readers don't
+    block the writer, with fsyncs at checkpoints only
+    """
+    cursor = connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.close()
+
+
 class DB:
     """DB class
     """
 
-    def __init__(self) -> None:
-        """Initialize a new DB instance
+    def __init__(self, reset: bool = False, url: str = DB_URL) -> None:
+        """Initialize a new DB instance, keeping the existing data
+        unless `reset` is set
+        """
+        url = make_url(url)
+        options = {}
+        if url.get_backend_name() == 'sqlite':
+            # Pooled connections move between request threads
+            options['connect_args'] = {'check_same_thread': False,
+                                       'timeout': BUSY_TIMEOUT}
+        if _is_memory_db(url):
+            # One connection shared by all threads, holding the database
+            options['poolclass'] = StaticPool
+        else:
+            options['pool_size'] = _env_int('DB_POOL_SIZE', POOL_SIZE)
+            options['max_overflow'] = _env_int('DB_MAX_OVERFLOW',
+                                               MAX_OVERFLOW)
+        self._engine = create_engine(url, **options)
+        if self._engine.dialect.name == 'sqlite':
+            event.listen(self._engine, 'connect', _set_sqlite_pragmas)
+
+        if reset:
+            Base.metadata.drop_all(self._engine)
+        self.create_schema()
+
+        # One session per thread; objects stay usable after commit
+        self.__session = scoped_session(
+            sessionmaker(bind=self._engine, expire_on_commit=False))
+
+    def create_schema(self) -> None:
+        """Create the missing tables and indexes
+
+        create_all skips the indexes of tables that already exist,
+        so they are created one by one for databases made before them.
+        Raise ValueError, naming the duplicated values, if the rows of
+        such a database break a missing unique index.
         """
-        self._engine = create_engine("sqlite:///a.db")
-        Base.metadata.drop_all(self._engine)
         Base.metadata.create_all(self._engine)
-        self.__session = None
+        inspector = inspect(self._engine)
+        for table in Base.metadata.sorted_tables:
+            existing = {index['name']
+                        for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name in existing:
+                    continue
+                if index.unique:
+                    self._check_unique(index)
+                index.create(self._engine)
+
+    def _check_unique(self, index) -> None:
+        """Raise ValueError if rows share the values of the columns
+        of `index`
+        """
+        columns = list(index.columns)
+        query = select(*columns).group_by(*columns) \
+            .having(func.count() > 1).limit(10)
+        with self._engine.connect() as connection:
+            duplicates = [', '.join(map(str, row))
+                          for row in connection.execute(query)]
+        if duplicates:
+            raise ValueError(
+                f'Cannot create unique index {index.name}: '
+                f'duplicated {", ".join(c.name for c in columns)} '
+                f'values {"; ".join(duplicates)}')
 
     @property
     def _session(self) -> Session:
-        """Memoized session object
+        """Session object of the current thread
         """
-        if self.__session is None:
-            DBSession = sessionmaker(bind=self._engine)
-            self.__session = DBSession()
-        return self.__session
+        return self.__session()
+
+    def remove_session(self) -> None:
+        """Close the session of the current thread, rolling back what
+        wasn't committed, and give its connection back to the pool
+        """
+        self.__session.remove()
 
     def add_user(self, email: str, hashed_password: str) -> User:
         """Add a user to the database"""
@@ -48,6 +154,39 @@ class DB:
         # Return user
         return user
 
+    def add_users(self, users: Iterable[Tuple[str, str]]) -> int:
+        """Add (email, hashed_password) users to the database
+        in a single transaction, and return how many there were
+
+        Raise IntegrityError, adding none of them, if an email
+        is already registered
+        """
+
+        # Insert all users at once
+        rows = [{'email': email, 'hashed_password': hashed_password}
+                for email, hashed_password in users]
+        if not rows:
+            return 0
+        try:
+            self._session.execute(insert(User), rows)
+            self._session.commit()
+        except IntegrityError:
+            self._session.rollback()
+            raise
+
+        return len(rows)
+
+    def existing_emails(self, emails: Iterable[str]) -> Set[str]:
+        """Return which of `emails` are already registered
+        """
+        emails = list(emails)
+        existing = set()
+        for i in range(0, len(emails), IN_BATCH):
+            existing.update(self._session.scalars(
+                select(User.email)
+                .where(User.email.in_(emails[i:i + IN_BATCH]))))
+        return existing
+
     @staticmethod
     def check_keys(kwargs: Dict) -> None:
         """Check kwargs keys are valid User attributes
@@ -79,7 +218,8 @@ class DB:
         return user
 
     def update_user(self, user_id: int, **kwargs) -> None:
-        """Update the user’s attributes as passed in the `kwargs`
+        """Update the user’s attributes as passed in the `kwargs`,
+        with a single UPDATE statement
         """
 
         # Check kwargs keys
@@ -88,12 +228,50 @@ class DB:
         except InvalidRequestError:
             raise ValueError
 
-        # Find the user
-        user = self.find_user_by(id=user_id)
+        # Nothing to update, but the user must still exist
+        if not kwargs:
+            self.find_user_by(id=user_id)
+            return
+
+        # Update the user
+        result = self._session.execute(
+            update(User).where(User.id == user_id).values(**kwargs))
 
-        # Update user
-        for key, value in kwargs.items():
-            setattr(user, key, value)
+        # Raise NoResultFound if not found
+        if result.rowcount == 0:
+            self._session.rollback()
+            raise NoResultFound
 
         # Commit changes
         self._session.commit()
+
+    def update_users(self, user_ids: Iterable[int] = None, **kwargs) -> int:
+        """Update the attributes passed in the `kwargs` of all users with
+        the given IDs (all users by default) and return how many there were
+        """
+
+        # Check kwargs keys
+        try:
+            self.check_keys(kwargs)
+        except InvalidRequestError:
+            raise ValueError
+        if not kwargs:
+            return 0
+
+        # Update all users at once, or by batches of IDs
+        count = 0
+        if user_ids is None:
+            count = self._session.execute(
+                update(User).values(**kwargs)).rowcount
+        else:
+            user_ids = list(user_ids)
+            for i in range(0, len(user_ids), IN_BATCH):
+                count += self._session.execute(
+                    update(User)
+                    .where(User.id.in_(user_ids[i:i + IN_BATCH]))
+                    .values(**kwargs)).rowcount
+
+        # Commit changes
+        self._session.commit()
+
+        return count
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""Import users in bulk from a CSV or NDJSON stream
+
+CSV files have a header with at least the email and password columns,
+NDJSON files one {"email": ..., "password": ...} object per line:
+$ ./import_users.py users.csv
+$ ./import_users.py --format ndjson < users.ndjson
+"""
+import argparse
+from auth import Auth, REGISTER_BATCH
+import csv
+import json
+import sys
+from typing import Iterator, TextIO, Tuple
+
+
+def read_csv(f: TextIO) -> Iterator[Tuple[str, str]]:
+    """Yield the (email, password) pairs of a CSV stream
+    """
+    for row in csv.DictReader(f):
+        if row.get('email') and row.get('password'):
+            yield row['email'], row['password']
+
+
+def read_ndjson(f: TextIO) -> Iterator[Tuple[str, str]]:
+    """Yield the (email, password) pairs of a NDJSON stream
+    """
+    for line in f:
+        if not line.strip():
+            continue
+        row = json.loads(line)
+        if row.get('email') and row.get('password'):
+            yield row['email'], row['password']
+
+
+def main() -> None:
+    """Register the users of the input and print the counts
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('path', nargs='?', default='-',
+                        help='CSV or NDJSON file, standard input by default')
+    parser.add_argument('--format', choices=('csv', 'ndjson'),
+                        help='input format, from the file extension '
+                             'by default, else CSV')
+    parser.add_argument('--batch-size', type=int, default=REGISTER_BATCH,
+                        help='users inserted per transaction')
+    parser.add_argument('--workers', type=int,
+                        help='threads hashing passwords')
+    args = parser.parse_args()
+
+    input_format = args.format
+    if input_format is None:
+        is_ndjson = args.path.endswith(('.ndjson', '.jsonl'))
+        input_format = 'ndjson' if is_ndjson else 'csv'
+    read = read_ndjson if input_format == 'ndjson' else read_csv
+
+    f = sys.stdin if args.path == '-' else open(args.path, newline='')
+    with f:
+        created, duplicates = Auth().register_users(
+            read(f), args.batch_size, args.workers)
+
+    print(f'{created} users created, {len(duplicates)} duplicates skipped')
+    for email in duplicates:
+        print(f'duplicate: {email}', file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -13,10 +13,10 @@ class User(Base):
 
     Attributes:
         id: the integer primary key
-        email: a non-nullable string
+        email: a non-nullable string, unique and indexed
         hashed_password: a non-nullable string
-        session_id: a nullable string
-        reset_token: a nullable string
+        session_id: a nullable string, indexed
+        reset_token: a nullable string, indexed
     """
 
     # Table name
@@ -24,10 +24,10 @@ class User(Base):
 
     # Columns
     id = Column(Integer, primary_key=True)
-    email = Column(String(250), nullable=False)
+    email = Column(String(250), nullable=False, unique=True, index=True)
     hashed_password = Column(String(250), nullable=False)
-    session_id = Column(String(250))
-    reset_token = Column(String(250))
+    session_id = Column(String(250), index=True)
+    reset_token = Column(String(250), index=True)
 
     def __repr__(self):
         """Representation of the user instance